@@ -1,17 +1,19 @@
+import collections
 import logging
 import os
 import threading
 import time
 
-import requests
-
 logger = logging.getLogger("node")
 
 from node import config
 from node.audio_player import AudioPlayer
 from node.dir import BASEDIR, SOUNDSDIR
+from node.hub import HubClient
 from node.listener import Listener
+from node.microphone import Microphone
 from node.processor import Processor
+from node.response_cache import ResponseCache
 from node.timer import Timer
 from node.utils.hardware import (
     get_supported_samplerates,
@@ -21,6 +23,7 @@ from node.utils.hardware import (
     select_speaker,
 )
 from node.utils.network import get_my_ip, scan_for_hub
+from node.wake import calibrate
 
 
 class Node:
@@ -36,6 +39,7 @@ class Node:
         self.port = port
         self.running = threading.Event()
         self.running.set()
+        self.hub = None
 
     def stop(self):
         logger.info("Stopping node")
@@ -55,6 +59,19 @@ class Node:
         time.sleep(3)
         self.start()
 
+    def connect_hub(self, hub_api_url: str) -> HubClient:
+        # The client outlives restarts so its connections stay warm
+        if self.hub is None or self.hub.base_url != hub_api_url:
+            if self.hub:
+                self.hub.close()
+            self.hub = HubClient(
+                hub_api_url,
+                connect_timeout=config.get("hub_connect_timeout_s"),
+                read_timeout=config.get("hub_read_timeout_s"),
+                keepalive_s=config.get("hub_keepalive_s"),
+            )
+        return self.hub
+
     def sync(self, sync_up: bool = False):
         # Run Startup Sync with HUB
         logger.info("Node Syncing with HUB...")
@@ -82,7 +99,7 @@ class Node:
             hub_ip = scan_for_hub(device_ip, self.hub_port)
             config.set("hub_ip", hub_ip)
 
-        hub_api_url = f"http://{hub_ip}:{self.hub_port}/api"
+        hub = self.connect_hub(f"http://{hub_ip}:{self.hub_port}/api")
 
         sync_data = {
             "id": node_id,
@@ -109,15 +126,17 @@ class Node:
             try:
                 if sync_up:
                     logger.info("Pushing local configuration to HUB")
-                    response = requests.put(
-                        f"{hub_api_url}/node/{node_id}/sync_up",
+                    response = hub.put(
+                        f"node/{node_id}/sync_up",
+                        endpoint="node/sync_up",
                         json=sync_data,
                         timeout=5,
                     )
                 else:
                     logger.info("Pulling configuration from HUB")
-                    response = requests.put(
-                        f"{hub_api_url}/node/{node_id}/sync_down",
+                    response = hub.put(
+                        f"node/{node_id}/sync_down",
+                        endpoint="node/sync_down",
                         json=sync_data,
                         timeout=5,
                     )
@@ -168,6 +187,8 @@ class Node:
 
         self.timer = None
         self.engaged = False
+        # Latency traces of the most recent interactions
+        self.traces = collections.deque(maxlen=config.get("trace_history"))
 
         self.id = config.get("id")
         self.name = config.get("name")
@@ -176,6 +197,11 @@ class Node:
         self.wake_word = config.get("wake_word")
         self.wakeup_sound = config.get("wakeup_sound")
         self.wake_word_conf_threshold = config.get("wake_word_conf_threshold")
+        # The HUB manages the main wake word, any others are set on the node
+        self.wake_words = {
+            self.wake_word: self.wake_word_conf_threshold,
+            **config.get("extra_wake_words"),
+        }
         self.speex_noise_suppression = config.get(
             "speex_noise_suppression"
         ) and config.get("speex_available")
@@ -184,9 +210,40 @@ class Node:
         self.speaker_idx = config.get("speaker_index")
         self.vad_sensitivity = config.get("vad_sensitivity")
         self.vad_threshold = config.get("vad_threshold")
+        self.inference_framework = config.get("inference_framework")
+        self.onnx_profile = config.get("onnx_profile")
+        self.wake_smoothing_blocks = config.get("wake_smoothing_blocks")
+        self.wake_patience = config.get("wake_patience")
+        self.wake_patience_window = config.get("wake_patience_window")
+        self.wake_refractory_ms = config.get("wake_refractory_ms")
+        self.wake_verifier = config.get("wake_verifier")
+        self.wake_gate_rms = config.get("wake_gate_rms")
+        self.wake_gate_hangover_ms = config.get("wake_gate_hangover_ms")
         self.volume = config.get("volume")
+        self.pre_roll_ms = config.get("pre_roll_ms")
+        self.stream_audio = config.get("stream_audio")
+        self.audio_transport = config.get("audio_transport")
+        self.upload_codec = config.get("upload_codec")
+        self.save_audio_files = config.get("save_audio_files")
+        self.stream_response_audio = config.get("stream_response_audio")
+        self.response_cache_mb = config.get("response_cache_mb")
+        self.response_cache_disk_mb = config.get("response_cache_disk_mb")
+        self.pipeline = config.get("pipeline")
+        self.barge_in = config.get("barge_in")
+        self.local_intents = config.get("local_intents")
+        self.local_intents_min_conf = config.get("local_intents_min_conf")
+        self.capture_queue_blocks = config.get("capture_queue_blocks")
+        self.capture_drop_policy = config.get("capture_drop_policy")
+        self.beamforming = config.get("beamforming")
+        self.endpoint_timeout_ms = config.get("endpoint_timeout_ms")
+        self.endpoint_min_hangover_ms = config.get("endpoint_min_hangover_ms")
+        self.endpoint_max_hangover_ms = config.get("endpoint_max_hangover_ms")
+        self.endpoint_max_utterance_ms = config.get("endpoint_max_utterance_ms")
+        self.trim_command_audio = config.get("trim_command_audio")
+        self.trim_padding_ms = config.get("trim_padding_ms")
 
         self.hub_api_url = f"http://{self.hub_ip}:{self.hub_port}/api"
+        self.connect_hub(self.hub_api_url)
 
         # MICROPHONE SETTINGS
         logger.info("Available Microphones:")
@@ -208,9 +265,21 @@ class Node:
         )
         [logger.info(f"- {rate}") for rate in supported_rates]
 
-        self.sample_rate = supported_rates[0]
+        # Capture at the device's native rate, everything downstream of the
+        # listener's resampler runs at 16kHz
+        self.capture_rate = supported_rates[0]
+        self.sample_rate = 16000
         self.sample_width = 2
         self.audio_channels = 1
+        # The 4-mic HAT is captured on every channel and beamformed down to
+        # one channel by the listener
+        self.capture_channels = 1
+        if self.beamforming and "seeed-4mic-voicecard" in self.mic_tag:
+            self.capture_channels = 4
+        self.frames_per_buffer = 1280
+        self.capture_frames_per_buffer = (
+            self.frames_per_buffer * self.capture_rate // self.sample_rate
+        )
 
         # SPEAKER SETTINGS
         logger.info("Available Speakers")
@@ -232,11 +301,27 @@ class Node:
         logger.info(f"- Name:             {self.name}")
         logger.info(f"- Area:             {self.area}")
         logger.info(f"- HUB:              {self.hub_ip}")
+        logger.info(
+            f"- HUB Timeouts:     {self.hub.connect_timeout}s connect, {self.hub.read_timeout}s read"
+        )
+        logger.info(f"- HUB Keepalive:    {self.hub.keepalive_s}s")
         logger.info("Wakeword Settings")
         logger.info(f"- Wake Word:        {self.wake_word}")
         logger.info(f"- Omni-Directional: {self.omni_directional_wake_word}")
         logger.info(f"- Wake Conf:        {self.wake_word_conf_threshold}")
+        for wake_word, threshold in config.get("extra_wake_words").items():
+            logger.info(f"- Extra Wake Word:  {wake_word} ({threshold})")
         logger.info(f"- Vad Thresh:       {self.vad_threshold}")
+        logger.info(f"- Inference:        {self.inference_framework}")
+        logger.info(f"- ONNX Profile:     {self.onnx_profile}")
+        logger.info(f"- Smoothing:        {self.wake_smoothing_blocks} blocks")
+        logger.info(
+            f"- Patience:         {self.wake_patience} of {self.wake_patience_window} blocks"
+        )
+        logger.info(f"- Refractory:       {self.wake_refractory_ms}ms")
+        logger.info(f"- Verifier:         {self.wake_verifier}")
+        logger.info(f"- Gate RMS:         {self.wake_gate_rms}")
+        logger.info(f"- Gate Hangover:    {self.wake_gate_hangover_ms}ms")
         logger.info(f"- Noise Suppress:   {self.speex_noise_suppression}")
         logger.info(f"- Wakeup Sound:     {self.wakeup_sound}")
         logger.info("IO Settings")
@@ -244,10 +329,35 @@ class Node:
         logger.info(f"- Microphone IDX:   {self.mic_idx}")
         logger.info(f"- Speaker:          {self.speaker_tag}")
         logger.info(f"- Speaker IDX:      {self.speaker_idx}")
+        logger.info(f"- Capture Rate:     {self.capture_rate}")
         logger.info(f"- Sample Rate:      {self.sample_rate}")
         logger.info(f"- Sample Width:     {self.sample_width}")
         logger.info(f"- Audio Channels:   {self.audio_channels}")
+        logger.info(f"- Beamforming:      {self.capture_channels > 1}")
+        logger.info(f"- Pre-roll:         {self.pre_roll_ms}ms")
+        logger.info(f"- Stream Audio:     {self.stream_audio}")
+        logger.info(f"- Audio Transport:  {self.audio_transport}")
+        logger.info(f"- Upload Codec:     {self.upload_codec}")
+        logger.info(f"- Save Audio Files: {self.save_audio_files}")
+        logger.info(f"- Stream Response:  {self.stream_response_audio}")
+        logger.info(
+            f"- Response Cache:   {self.response_cache_mb}MB memory, {self.response_cache_disk_mb}MB disk"
+        )
+        logger.info(f"- Capture Queue:    {self.capture_queue_blocks} blocks")
+        logger.info(f"- Drop Policy:      {self.capture_drop_policy}")
+        logger.info("Endpoint Settings")
+        logger.info(f"- Timeout:          {self.endpoint_timeout_ms}ms")
+        logger.info(
+            f"- Hangover:         {self.endpoint_min_hangover_ms}-{self.endpoint_max_hangover_ms}ms"
+        )
+        logger.info(f"- Max Utterance:    {self.endpoint_max_utterance_ms}ms")
+        logger.info(f"- Trim Audio:       {self.trim_command_audio}")
+        logger.info(f"- Trim Padding:     {self.trim_padding_ms}ms")
         logger.info(f"- Volume:           {self.volume}")
+        logger.info(f"- Pipeline:         {self.pipeline}")
+        logger.info(f"- Barge-in:         {self.barge_in}")
+        logger.info(f"- Local Intents:    {self.local_intents}")
+        logger.info(f"- Intent Conf:      {self.local_intents_min_conf}")
 
         try:
             from node.utils.leds import Pixels, Respeaker4MicHat
@@ -271,8 +381,36 @@ class Node:
             logger.error("Failed to initialize mixer")
             self.mixer = None
 
+        if self.inference_framework == "auto":
+            # Benchmark the backends once per set of wake words and profile,
+            # after that the stored choice is reused
+            calibration = config.get("wake_calibration")
+            if (
+                calibration.get("wake_words") != sorted(self.wake_words)
+                or calibration.get("onnx_profile") != self.onnx_profile
+            ):
+                logger.info("Calibrating wake word inference backends")
+                calibration = config.set(
+                    "wake_calibration", calibrate(self.wake_words, self.onnx_profile)
+                )
+            self.inference_framework = calibration["backend"]
+            logger.info(f"Using {self.inference_framework} for wake word inference")
+
         # INITIALIZING COMPONENTS
+        self.microphone = Microphone(
+            self.mic_idx,
+            self.capture_rate,
+            self.capture_channels,
+            self.capture_frames_per_buffer,
+            queue_blocks=self.capture_queue_blocks,
+            drop_policy=self.capture_drop_policy,
+        )
+        self.microphone.start()
         self.audio_player = AudioPlayer(self)
+        self.response_cache = ResponseCache(
+            int(self.response_cache_mb * 1024 * 1024),
+            int(self.response_cache_disk_mb * 1024 * 1024),
+        )
         self.listener = Listener(self)
         self.processor = Processor(self)
 
@@ -282,14 +420,18 @@ class Node:
         self.last_time_engaged = time.time()
         while self.running.is_set():
             if self.omni_directional_wake_word:
-                self.listener.listen_omni_directional()
+                command_audio = self.listener.listen_omni_directional()
             else:
-                self.listener.listen()
+                command_audio = self.listener.listen()
             if not self.running.is_set():
                 break
-            self.processor.process_audio()
-            if self.led_controller:
-                self.led_controller.off()
+            interaction = self.processor.interaction(command_audio)
+            if self.pipeline:
+                # Back to listening while the HUB works on the command
+                self.processor.submit(interaction)
+            else:
+                self.processor.run(interaction)
+        self.microphone.stop()
         logger.warning("Mainloop end")
 
     def set_volume(self, volume: int):
@@ -1,19 +1,38 @@
+import io
 import logging
 import threading
+import time
+import typing
 
 import sounddevice as sd
 import soundfile as sf
 
 logger = logging.getLogger("audio_player")
 
+from node.trace import stream_to_monotonic
+from node.utils.transport import parse_wav_header
+
+# WAVE_FORMAT_PCM and WAVE_FORMAT_EXTENSIBLE
+PCM_FORMATS = [0x0001, 0xFFFE]
+
 
 class AudioPlayer:
     def __init__(self, node):
         self.node = node
         self.speaker_idx = node.speaker_idx
+        self.stream = None
+        self.interrupted = threading.Event()
+        # Monotonic times the last streamed response first reached PortAudio
+        # and the DAC
+        self.first_audio = None
+        self.first_audio_dac = None
+        self.underruns = 0
 
     def play_audio_file(
-        self, file: str, asynchronous: bool = False, loop: bool = False
+        self,
+        file: typing.Union[str, typing.BinaryIO],
+        asynchronous: bool = False,
+        loop: bool = False,
     ):
         if asynchronous == False and loop == True:
             raise RuntimeWarning("Infinite loop detected")
@@ -23,9 +42,99 @@ class AudioPlayer:
             data, fs, device=self.speaker_idx, blocking=(not asynchronous), loop=loop
         )
 
+    def play_audio_data(
+        self, audio_data: bytes, asynchronous: bool = False, loop: bool = False
+    ):
+        self.play_audio_file(io.BytesIO(audio_data), asynchronous, loop)
+
+    def play_audio_stream(self, chunks: typing.Iterable[bytes]) -> bytes:
+        # Plays a WAV while it downloads. The output stream opens as soon as
+        # the header is in and the callback drains whatever has arrived,
+        # padding with silence if the download falls behind. Returns the
+        # whole WAV so it can be saved. Playback stops early once interrupted
+        # is set, it is cleared by the processor as each command comes in.
+        self.first_audio = None
+        self.first_audio_dac = None
+        chunks = iter(chunks)
+        data = bytearray()
+        header = None
+        for chunk in chunks:
+            data += chunk
+            header = parse_wav_header(data)
+            if header:
+                break
+        if header is None:
+            logger.warning(f"Response ended before the WAV header ({len(data)} bytes)")
+            return bytes(data)
+
+        audio_format, sample_rate, channels, sample_width, offset = header
+        if audio_format not in PCM_FORMATS or sample_width != 2:
+            # Only int16 is streamed, anything else plays once it is all in
+            for chunk in chunks:
+                data += chunk
+            self.first_audio = time.monotonic()
+            self.play_audio_data(bytes(data))
+            return bytes(data)
+
+        frame_size = channels * sample_width
+        pending = bytearray(data[offset:])
+        lock = threading.Lock()
+        downloaded = threading.Event()
+        finished = threading.Event()
+
+        def callback(outdata, frames, time_info, status):
+            with lock:
+                n = min(len(outdata), len(pending) - len(pending) % frame_size)
+                outdata[:n] = pending[:n]
+                del pending[:n]
+                remaining = len(pending)
+            outdata[n:] = b"\x00" * (len(outdata) - n)
+            if n and self.first_audio is None:
+                self.first_audio = time.monotonic()
+                if time_info.outputBufferDacTime:
+                    self.first_audio_dac = stream_to_monotonic(
+                        time_info.outputBufferDacTime, time_info.currentTime
+                    )
+            if downloaded.is_set() and remaining < frame_size:
+                raise sd.CallbackStop
+            if n < len(outdata) and self.first_audio is not None:
+                self.underruns += 1
+
+        stream = self.stream = sd.RawOutputStream(
+            samplerate=sample_rate,
+            device=self.speaker_idx,
+            dtype="int16",
+            channels=channels,
+            callback=callback,
+            blocksize=1024,
+            finished_callback=finished.set,
+        )
+        with stream:
+            for chunk in chunks:
+                if self.interrupted.is_set():
+                    break
+                data += chunk
+                with lock:
+                    pending += chunk
+            downloaded.set()
+            while not finished.wait(0.1):
+                if self.interrupted.is_set():
+                    stream.abort()
+                    break
+        self.stream = None
+        return bytes(data)
+
+    def stop_sounds(self):
+        # Stops sd.play only, a streamed response keeps going
+        sd.stop()
+
     def interrupt(self):
         logger.warning("Audio interrupted")
         sd.stop()
+        self.interrupted.set()
+        stream = self.stream
+        if stream:
+            stream.abort()
 
     def play_sounddevice(self, file: str):
         data, fs = sf.read(file, dtype="float32")
@@ -0,0 +1,755 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import click
+import numpy as np
+import openwakeword
+import sounddevice as sd
+import soundfile as sf
+import webrtcvad
+
+from node import config
+from node.dir import WAKEWORDMODELSDIR
+from node.endpointing import Endpointer
+from node.inference import SessionFactory, available_profiles
+from node.model_store import ModelStore
+from node.utils.beamforming import RESPEAKER_4MIC, SPEED_OF_SOUND, Beamformer
+from node.utils.codecs import CODECS, encode_audio
+from node.utils.resample import Resampler
+from node.utils.ring_buffer import RingBuffer
+from node.wake import BLOCK_SAMPLES, OpenWakeWord, calibrate
+
+
+def report(results: dict):
+    click.echo(json.dumps(results, indent=4))
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    values = np.array(values)
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+def read_wav(wav_file: str) -> tuple:
+    audio, sample_rate = sf.read(wav_file, dtype="int16", always_2d=True)
+    return np.ascontiguousarray(audio[:, 0]), sample_rate
+
+
+def time_inference(wake: OpenWakeWord, audio: np.ndarray) -> tuple:
+    # Per block latency of listen_for_wake_word, plus how late a thread that
+    # stands in for the audio callback wakes up every 10ms meanwhile
+    latencies = []
+    lateness = []
+    stop = threading.Event()
+
+    def callback():
+        deadline = time.perf_counter()
+        while not stop.is_set():
+            deadline += 0.01
+            time.sleep(max(0, deadline - time.perf_counter()))
+            lateness.append(max(0, time.perf_counter() - deadline) * 1000)
+
+    thread = threading.Thread(target=callback, daemon=True)
+    thread.start()
+    for i in range(0, len(audio) - BLOCK_SAMPLES + 1, BLOCK_SAMPLES):
+        start = time.perf_counter()
+        wake.listen_for_wake_word(audio[i : i + BLOCK_SAMPLES].tobytes())
+        latencies.append((time.perf_counter() - start) * 1000)
+    stop.set()
+    thread.join()
+    return latencies, lateness
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command("ring-buffer")
+@click.option("--seconds", required=False, default=600, type=int)
+@click.option("--sample_rate", required=False, default=16000, type=int)
+@click.option("--frames_per_buffer", required=False, default=1280, type=int)
+@click.option("--vad_chunk_size", required=False, default=960, type=int)
+def ring_buffer(seconds, sample_rate, frames_per_buffer, vad_chunk_size):
+    # Compare the old bytes concatenation framing against the ring buffer over
+    # the same simulated audio. A timed pass, then a pass under tracemalloc
+    # that adds up how far each chunk pushes traced memory above where it
+    # started, the memory framing allocates for it even if freed right after.
+    chunk = bytes(frames_per_buffer * 2)
+    n_chunks = int(seconds * sample_rate / frames_per_buffer)
+
+    def bytes_framer():
+        vad_audio_data = bytes()
+
+        def step():
+            nonlocal vad_audio_data
+            frames = 0
+            vad_audio_data += chunk
+            while len(vad_audio_data) >= vad_chunk_size:
+                vad_chunk = vad_audio_data[:vad_chunk_size]
+                vad_audio_data = vad_audio_data[vad_chunk_size:]
+                frames += len(vad_chunk) == vad_chunk_size
+            return frames
+
+        return step
+
+    def ring_buffer_framer():
+        buffer = RingBuffer(len(chunk) + vad_chunk_size, frame_size=vad_chunk_size)
+
+        def step():
+            frames = 0
+            buffer.write(chunk)
+            for vad_chunk in buffer.frames():
+                frames += len(vad_chunk) == vad_chunk_size
+            return frames
+
+        return step
+
+    results = {"audio_seconds": seconds}
+    for name, framer in (("bytes", bytes_framer), ("ring_buffer", ring_buffer_framer)):
+        step = framer()
+        frames = 0
+        start = time.perf_counter()
+        for _ in range(n_chunks):
+            frames += step()
+        elapsed = time.perf_counter() - start
+
+        step = framer()
+        allocated = 0
+        tracemalloc.start()
+        blocks = sys.getallocatedblocks()
+        for _ in range(n_chunks):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            step()
+            allocated += tracemalloc.get_traced_memory()[1] - current
+        blocks = sys.getallocatedblocks() - blocks
+        tracemalloc.stop()
+
+        results[name] = {
+            "frames": frames,
+            "allocated_bytes_per_second": allocated / seconds,
+            "allocated_blocks_retained": blocks,
+            "cpu_seconds_per_audio_second": elapsed / seconds,
+        }
+    report(results)
+
+
+@main.command("codecs")
+@click.argument("wav_files", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--repeat", required=False, default=5, type=int)
+@click.option("--link_kbps", required=False, default=1000, type=int)
+def codecs(wav_files, repeat, link_kbps):
+    # Encode CPU cost against bytes saved for each upload codec. The upload
+    # time at --link_kbps shows whether the trade pays off on a given link.
+    clips = [sf.read(wav_file, dtype="int16") for wav_file in wav_files]
+    audio_seconds = sum(len(audio) / sample_rate for audio, sample_rate in clips)
+
+    results = {"audio_seconds": audio_seconds, "link_kbps": link_kbps}
+    for codec in CODECS:
+        encoded_bytes = 0
+        start = time.process_time()
+        for _ in range(repeat):
+            encoded_bytes = 0
+            for audio, sample_rate in clips:
+                data, _ = encode_audio(audio, sample_rate, codec)
+                encoded_bytes += len(data)
+        encode_seconds = (time.process_time() - start) / repeat
+        upload_seconds = encoded_bytes * 8 / (link_kbps * 1000)
+        results[codec] = {
+            "bytes": encoded_bytes,
+            "encode_cpu_seconds_per_audio_second": encode_seconds / audio_seconds,
+            "upload_seconds_per_audio_second": upload_seconds / audio_seconds,
+            "total_seconds_per_audio_second": (encode_seconds + upload_seconds)
+            / audio_seconds,
+        }
+    for codec in CODECS:
+        results[codec]["ratio"] = results[codec]["bytes"] / results["wav"]["bytes"]
+    report(results)
+
+
+@main.command("mic-reopen")
+@click.option("--mic_index", required=False, default=None, type=int)
+@click.option("--sample_rate", required=False, default=16000, type=int)
+@click.option("--frames_per_buffer", required=False, default=1280, type=int)
+@click.option("--cycles", required=False, default=10, type=int)
+@click.option("--timeout_s", required=False, default=5, type=float)
+def mic_reopen(mic_index, sample_rate, frames_per_buffer, cycles, timeout_s):
+    # Time from asking for a fresh input stream to its first block of audio.
+    # This is the audio every listen cycle used to lose before the node kept
+    # one stream open.
+    delays = []
+    for cycle in range(cycles):
+        first_block = threading.Event()
+
+        def callback(indata, frames, time, status, first_block=first_block):
+            first_block.set()
+
+        start = time.perf_counter()
+        with sd.InputStream(
+            samplerate=sample_rate,
+            device=mic_index,
+            channels=1,
+            blocksize=frames_per_buffer,
+            callback=callback,
+            dtype="int16",
+        ):
+            if not first_block.wait(timeout_s):
+                raise click.ClickException(
+                    f"No audio from the input device within {timeout_s}s"
+                    f" on cycle {cycle + 1}"
+                )
+            delays.append(time.perf_counter() - start)
+
+    delays = np.array(delays) * 1000
+    report(
+        {
+            "cycles": cycles,
+            "block_ms": frames_per_buffer / sample_rate * 1000,
+            "reopen_to_first_block_ms": {
+                "mean": float(delays.mean()),
+                "p50": float(np.percentile(delays, 50)),
+                "max": float(delays.max()),
+            },
+        }
+    )
+
+
+@main.command("endpointing")
+@click.argument("wav_files", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--vad_sensitivity", required=False, default=3, type=int)
+@click.option("--timeout_ms", required=False, default=1500, type=int)
+@click.option("--min_hangover_ms", required=False, default=200, type=int)
+@click.option("--max_hangover_ms", required=False, default=500, type=int)
+@click.option("--max_utterance_ms", required=False, default=10000, type=int)
+def endpointing(
+    wav_files,
+    vad_sensitivity,
+    timeout_ms,
+    min_hangover_ms,
+    max_hangover_ms,
+    max_utterance_ms,
+):
+    # Replays recorded commands, each starting right after the wake word, and
+    # measures the time from the last speech frame to the endpoint. "fixed" is
+    # the previous rule of a flat 0.5 s hangover. A clip counts as truncated
+    # when VAD finds speech after the endpoint.
+    vad = webrtcvad.Vad(vad_sensitivity)
+    vad_frame_samples = 480  # Listener.vad_chunk_size in samples
+
+    endpointers = {
+        "adaptive": lambda frame_ms: Endpointer(
+            frame_ms,
+            timeout_ms=timeout_ms,
+            min_hangover_ms=min_hangover_ms,
+            max_hangover_ms=max_hangover_ms,
+            max_utterance_ms=max_utterance_ms,
+        ),
+        "fixed": lambda frame_ms: Endpointer(
+            frame_ms,
+            timeout_ms=timeout_ms,
+            min_hangover_ms=500,
+            max_hangover_ms=500,
+            max_utterance_ms=max_utterance_ms,
+        ),
+    }
+    latencies = {name: [] for name in endpointers}
+    truncated = {name: 0 for name in endpointers}
+    for wav_file in wav_files:
+        audio, sample_rate = read_wav(wav_file)
+        frame_ms = vad_frame_samples / sample_rate * 1000
+        speech = [
+            vad.is_speech(audio[i : i + vad_frame_samples].tobytes(), sample_rate)
+            for i in range(0, len(audio) - vad_frame_samples + 1, vad_frame_samples)
+        ]
+        for name, create in endpointers.items():
+            endpointer = create(frame_ms)
+            for is_speech in speech:
+                if endpointer.update(is_speech):
+                    break
+            if endpointer.last_speech_frame is None:
+                continue
+            if any(speech[endpointer.frame :]):
+                truncated[name] += 1
+            latencies[name].append(
+                (endpointer.frame - endpointer.last_speech_frame) * frame_ms
+            )
+
+    report(
+        {
+            name: {
+                "clips": len(latencies[name]),
+                "truncated": truncated[name],
+                "end_of_speech_to_endpoint_ms": percentiles(latencies[name]),
+            }
+            for name in endpointers
+        }
+    )
+
+
+@main.command("trim")
+@click.argument("wav_files", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--vad_sensitivity", required=False, default=3, type=int)
+@click.option("--pre_roll_ms", required=False, default=300, type=int)
+@click.option("--padding_ms", required=False, default=200, type=int)
+def trim(wav_files, vad_sensitivity, pre_roll_ms, padding_ms):
+    # Upload size with and without trimming, for recorded commands that
+    # start right after the wake word. Untrimmed is the pre-roll plus all
+    # audio up to the endpoint, trimmed is the first to last speech frame
+    # plus padding, as Listener.trim does.
+    vad = webrtcvad.Vad(vad_sensitivity)
+    vad_frame_samples = 480
+    untrimmed = 0
+    trimmed = 0
+    for wav_file in wav_files:
+        audio, sample_rate = read_wav(wav_file)
+        frame_ms = vad_frame_samples / sample_rate * 1000
+        endpointer = Endpointer(frame_ms)
+        for i in range(0, len(audio) - vad_frame_samples + 1, vad_frame_samples):
+            frame = audio[i : i + vad_frame_samples].tobytes()
+            if endpointer.update(vad.is_speech(frame, sample_rate)):
+                break
+        pre_roll = int(sample_rate * pre_roll_ms / 1000)
+        untrimmed += pre_roll + endpointer.frame * vad_frame_samples
+        if endpointer.last_speech_frame is None:
+            trimmed += pre_roll + endpointer.frame * vad_frame_samples
+            continue
+        padding = int(sample_rate * padding_ms / 1000)
+        start = pre_roll + (endpointer.first_speech_frame - 1) * vad_frame_samples
+        end = pre_roll + endpointer.last_speech_frame * vad_frame_samples
+        trimmed += min(end + padding, pre_roll + endpointer.frame * vad_frame_samples)
+        trimmed -= max(0, start - padding)
+
+    report(
+        {
+            "clips": len(wav_files),
+            "untrimmed_bytes": untrimmed * 2,
+            "trimmed_bytes": trimmed * 2,
+            "ratio": trimmed / max(1, untrimmed),
+        }
+    )
+
+
+@main.command("resample")
+@click.option("--seconds", required=False, default=60, type=int)
+@click.option("--capture_rate", required=False, default=48000, type=int)
+@click.option("--sample_rate", required=False, default=16000, type=int)
+@click.option("--frames_per_buffer", required=False, default=1280, type=int)
+def resample(seconds, capture_rate, sample_rate, frames_per_buffer):
+    # CPU cost of bringing native rate capture blocks down to the processing
+    # rate, next to how much audio the stages after it no longer have to see
+    block = frames_per_buffer * capture_rate // sample_rate
+    audio = (np.random.randn(seconds * capture_rate) * 3000).astype(np.int16)
+    resampler = Resampler(capture_rate, sample_rate)
+    output_bytes = 0
+    start = time.process_time()
+    for i in range(0, len(audio) - block + 1, block):
+        output_bytes += len(resampler.process(audio[i : i + block].tobytes()))
+    elapsed = time.process_time() - start
+    report(
+        {
+            "audio_seconds": seconds,
+            "capture_rate": capture_rate,
+            "sample_rate": sample_rate,
+            "block_ms": block / capture_rate * 1000,
+            "cpu_seconds_per_audio_second": elapsed / seconds,
+            "downstream_bytes_ratio": output_bytes / (len(audio) * 2),
+        }
+    )
+
+
+@main.command("beamforming")
+@click.option("--seconds", required=False, default=10, type=int)
+@click.option("--sample_rate", required=False, default=16000, type=int)
+@click.option("--frames_per_buffer", required=False, default=1280, type=int)
+@click.option("--noise", required=False, default=0.5, type=float)
+def beamforming(seconds, sample_rate, frames_per_buffer, noise):
+    # Per block CPU cost of DOA plus delay-and-sum on the 4-mic HAT geometry,
+    # against the time one block of audio lasts. A simulated talker is placed
+    # at each test angle with independent noise on every mic, the gain is the
+    # SNR of the beam over the SNR of a single mic.
+    rng = np.random.default_rng(0)
+    n_samples = seconds * sample_rate
+    block = frames_per_buffer * sample_rate // 16000
+    freqs = np.fft.rfftfreq(n_samples, 1 / sample_rate)
+    band = (freqs >= 300) & (freqs <= 3400)
+
+    def beam(create, audio):
+        beamformer = create()
+        chunks = []
+        times = []
+        for i in range(0, len(audio) - block + 1, block):
+            chunk = audio[i : i + block].astype(np.int16).tobytes()
+            start = time.process_time()
+            chunks.append(beamformer.process(chunk))
+            times.append(time.process_time() - start)
+        output = np.frombuffer(b"".join(chunks), dtype=np.int16)
+        return beamformer, output.astype(float), times
+
+    block_times = []
+    errors = []
+    gains = []
+    for angle in range(0, 360, 45):
+        spectrum = np.fft.rfft(rng.standard_normal(n_samples)) * band
+        theta = np.radians(angle)
+        arrivals = -(RESPEAKER_4MIC @ [np.cos(theta), np.sin(theta)]) / SPEED_OF_SOUND
+        talker = np.stack(
+            [
+                np.fft.irfft(spectrum * np.exp(-2j * np.pi * freqs * t), n_samples)
+                for t in arrivals
+            ],
+            axis=1,
+        )
+        talker *= 3000 / talker.std()
+        interference = rng.standard_normal(talker.shape) * 3000 * noise
+
+        beamformer, _, times = beam(
+            lambda: Beamformer(sample_rate, RESPEAKER_4MIC), talker + interference
+        )
+        block_times.extend(times)
+        errors.append(abs((beamformer.direction - angle + 180) % 360 - 180))
+
+        def steered(beamformer=beamformer):
+            fixed = Beamformer(sample_rate, RESPEAKER_4MIC, min_rms=np.inf)
+            fixed.delays = beamformer.delays
+            return fixed
+
+        _, speech, _ = beam(steered, talker)
+        _, residual, _ = beam(steered, interference)
+        input_snr = talker[:, 0].var() / interference[:, 0].var()
+        gains.append(10 * np.log10(speech.var() / residual.var() / input_snr))
+
+    report(
+        {
+            "sample_rate": sample_rate,
+            "block_ms": block / sample_rate * 1000,
+            "cpu_ms_per_block": percentiles([t * 1000 for t in block_times]),
+            "doa_error_degrees": percentiles(errors),
+            "snr_gain_db": float(np.mean(gains)),
+        }
+    )
+
+
+@main.command("wake-gate")
+@click.argument("wav_files", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--wake_word", required=False, default="ova", type=str)
+@click.option("--threshold", required=False, default=0.8, type=float)
+@click.option("--gate_rms", required=False, default=80, type=float)
+@click.option("--gate_hangover_ms", required=False, default=800, type=int)
+def wake_gate(wav_files, wake_word, threshold, gate_rms, gate_hangover_ms):
+    # Runs the same room recordings through the wake word model with and
+    # without the energy gate. Point it at a long recording of a normal day,
+    # the skipped fraction and CPU saved are what the gate buys, detections
+    # missed by the gated run are what it costs.
+    def run(gate_rms):
+        wake = OpenWakeWord(
+            wake_words={wake_word: threshold},
+            speex_noise_suppression=False,
+            vad_threshold=0,
+            gate_rms=gate_rms,
+            gate_hangover_ms=gate_hangover_ms,
+        )
+        detections = set()
+        offset = 0
+        for wav_file in wav_files:
+            audio, sample_rate = read_wav(wav_file)
+            audio = np.frombuffer(
+                Resampler(sample_rate, 16000).process(audio.tobytes()), np.int16
+            )
+            for i in range(0, len(audio) - BLOCK_SAMPLES + 1, BLOCK_SAMPLES):
+                if wake.listen_for_wake_word(audio[i : i + BLOCK_SAMPLES].tobytes()):
+                    detections.add(offset + i // BLOCK_SAMPLES)
+            offset += len(audio) // BLOCK_SAMPLES
+        return wake.stats(), detections, offset * BLOCK_SAMPLES / 16000
+
+    ungated, expected, audio_seconds = run(0)
+    gated, detected, _ = run(gate_rms)
+    report(
+        {
+            "audio_seconds": audio_seconds,
+            "ungated": {
+                "cpu_seconds_per_audio_second": ungated["cpu_seconds"] / audio_seconds,
+                "detections": len(expected),
+            },
+            "gated": {
+                "cpu_seconds_per_audio_second": gated["cpu_seconds"] / audio_seconds,
+                "detections": len(detected),
+                "missed": len(expected - detected),
+                "skipped_fraction": gated["skipped_fraction"],
+                "cpu_seconds_saved": ungated["cpu_seconds"] - gated["cpu_seconds"],
+            },
+        }
+    )
+
+
+@main.command("cold-start")
+@click.option("--wake_word", required=False, default="ova", type=str)
+@click.option("--runs", required=False, default=3, type=int)
+def cold_start(wake_word, runs):
+    # Time until the wake word model is ready. "download_models" is the old
+    # startup, asking openWakeWord to download its models before loading
+    # them. "empty_store" starts from an empty model store and "store" from
+    # a complete one, which never touches the network.
+    def download_models():
+        openwakeword.utils.download_models()
+        openwakeword.Model(
+            wakeword_models=[os.path.join(WAKEWORDMODELSDIR, f"{wake_word}.onnx")],
+            inference_framework="onnx",
+        )
+
+    def create(model_store):
+        OpenWakeWord(
+            wake_words={wake_word: 0.5},
+            speex_noise_suppression=False,
+            vad_threshold=0,
+            model_store=model_store,
+        )
+
+    def empty_store():
+        with tempfile.TemporaryDirectory() as directory:
+            create(ModelStore(directory))
+
+    results = {}
+    for name, run in (
+        ("download_models", download_models),
+        ("empty_store", empty_store),
+        ("store", lambda: create(None)),
+    ):
+        times = []
+        try:
+            for _ in range(runs):
+                start = time.perf_counter()
+                run()
+                times.append((time.perf_counter() - start) * 1000)
+            results[name] = {"cold_start_ms": percentiles(times)}
+        except Exception as e:
+            results[name] = {"error": repr(e)}
+    report(results)
+
+
+@main.command("onnx-profiles")
+@click.option("--wake_word", required=False, default="ova", type=str)
+@click.option("--blocks", required=False, default=200, type=int)
+@click.option("--save", is_flag=True, default=False)
+def onnx_profiles(wake_word, blocks, save):
+    # Load time with an empty and a warm optimized model cache, and per block
+    # inference latency, for every session profile that fits on this board.
+    # The best profile has the lowest p90 latency plus audio callback
+    # lateness, --save makes it the node's onnx_profile.
+    audio = np.random.default_rng(0).standard_normal(blocks * BLOCK_SAMPLES) * 1000
+    audio = audio.astype(np.int16)
+
+    results = {}
+    for profile in available_profiles():
+        with tempfile.TemporaryDirectory() as cache_dir:
+            loads = []
+            for _ in range(2):
+                wake = OpenWakeWord(
+                    wake_words={wake_word: 0.5},
+                    speex_noise_suppression=False,
+                    vad_threshold=0,
+                    sessions=SessionFactory(profile, cache_dir),
+                )
+                loads.append(wake.load_time * 1000)
+        latencies, lateness = time_inference(wake, audio)
+        results[profile] = {
+            "cold_load_ms": loads[0],
+            "warm_load_ms": loads[1],
+            "latency_ms": percentiles(latencies),
+            "callback_lateness_ms": percentiles(lateness),
+        }
+
+    best = min(
+        results,
+        key=lambda profile: (
+            results[profile]["latency_ms"]["p90"]
+            + results[profile]["callback_lateness_ms"]["p90"]
+        ),
+    )
+    results["best"] = best
+    if save:
+        config.set("onnx_profile", best)
+    report(results)
+
+
+@main.command("backends")
+@click.option("--wake_word", required=False, multiple=True, default=["ova"])
+@click.option("--onnx_profile", required=False, default="single", type=str)
+@click.option("--blocks", required=False, default=60, type=int)
+@click.option("--save", is_flag=True, default=False)
+def backends(wake_word, onnx_profile, blocks, save):
+    # The node's startup calibration on demand: per block latency of every
+    # inference backend available here. --save stores the result the same
+    # way the node does when inference_framework is "auto".
+    calibration = calibrate(
+        {name: 0.5 for name in wake_word}, onnx_profile=onnx_profile, blocks=blocks
+    )
+    if save:
+        config.set("wake_calibration", calibration)
+    report(calibration)
+
+
+@main.command("wake")
+@click.option(
+    "--positives", required=False, type=click.Path(exists=True, file_okay=False)
+)
+@click.option(
+    "--negatives", required=False, type=click.Path(exists=True, file_okay=False)
+)
+@click.option("--wake_word", required=False, multiple=True, default=["ova"])
+@click.option("--threshold", required=False, default=0.8, type=float)
+@click.option("--inference_framework", required=False, default="onnx", type=str)
+@click.option("--onnx_profile", required=False, default="single", type=str)
+@click.option("--gate_rms", required=False, default=0, type=float)
+@click.option("--smoothing_blocks", required=False, default=1, type=int)
+@click.option("--patience", required=False, default=1, type=int)
+@click.option("--patience_window", required=False, default=1, type=int)
+@click.option("--refractory_ms", required=False, default=0, type=int)
+@click.option("--verifier", is_flag=True, default=False)
+@click.option("--tail_ms", required=False, default=1000, type=int)
+def wake(
+    positives,
+    negatives,
+    wake_word,
+    threshold,
+    inference_framework,
+    onnx_profile,
+    gate_rms,
+    smoothing_blocks,
+    patience,
+    patience_window,
+    refractory_ms,
+    verifier,
+    tail_ms,
+):
+    # Replays WAV corpora through listen_for_wake_word in Listener sized
+    # blocks. Every positive clip should hold one wake word, its end is the
+    # last speech frame found by webrtcvad and detection latency is measured
+    # from there, with --tail_ms of silence added so late detections count.
+    # Negative clips hold no wake word, every detection in them is a false
+    # accept. The model is reset per clip and after every detection, like a
+    # new listen session.
+    wake = OpenWakeWord(
+        wake_words={name: threshold for name in wake_word},
+        speex_noise_suppression=False,
+        vad_threshold=0,
+        inference_framework=inference_framework,
+        gate_rms=gate_rms,
+        sessions=SessionFactory(onnx_profile),
+        smoothing_blocks=smoothing_blocks,
+        patience=patience,
+        patience_window=patience_window,
+        refractory_ms=refractory_ms,
+        verifier=verifier,
+    )
+    vad = webrtcvad.Vad(3)
+    vad_frame_samples = 480
+    block_ms = BLOCK_SAMPLES / 16000 * 1000
+
+    def clips(folder):
+        if not folder:
+            return []
+        return sorted(
+            os.path.join(folder, name)
+            for name in os.listdir(folder)
+            if name.lower().endswith(".wav")
+        )
+
+    def load(wav_file):
+        audio, sample_rate = read_wav(wav_file)
+        return np.frombuffer(
+            Resampler(sample_rate, 16000).process(audio.tobytes()), dtype=np.int16
+        )
+
+    block_latencies = []
+    processing_seconds = 0
+
+    def replay(audio):
+        # Returns the end time in ms of every block a wake word fired on
+        nonlocal processing_seconds
+        wake.reset()
+        detections = []
+        for i in range(0, len(audio) - BLOCK_SAMPLES + 1, BLOCK_SAMPLES):
+            start = time.perf_counter()
+            fired = wake.listen_for_wake_word(audio[i : i + BLOCK_SAMPLES].tobytes())
+            elapsed = time.perf_counter() - start
+            processing_seconds += elapsed
+            block_latencies.append(elapsed * 1000)
+            if fired:
+                detections.append((i + BLOCK_SAMPLES) / 16000 * 1000)
+                wake.reset()
+        return detections
+
+    audio_seconds = 0
+    detected = 0
+    detection_latencies = []
+    positive_files = clips(positives)
+    for wav_file in positive_files:
+        audio = load(wav_file)
+        speech = [
+            vad.is_speech(audio[i : i + vad_frame_samples].tobytes(), 16000)
+            for i in range(0, len(audio) - vad_frame_samples + 1, vad_frame_samples)
+        ]
+        keyword_end_ms = len(audio) / 16000 * 1000
+        if any(speech):
+            last = len(speech) - 1 - speech[::-1].index(True)
+            keyword_end_ms = (last + 1) * vad_frame_samples / 16000 * 1000
+        audio = np.concatenate((audio, np.zeros(tail_ms * 16, dtype=np.int16)))
+        audio_seconds += len(audio) / 16000
+        detections = replay(audio)
+        if detections:
+            detected += 1
+            detection_latencies.append(max(0, detections[0] - keyword_end_ms))
+
+    negative_seconds = 0
+    false_accepts = 0
+    negative_files = clips(negatives)
+    for wav_file in negative_files:
+        audio = load(wav_file)
+        negative_seconds += len(audio) / 16000
+        false_accepts += len(replay(audio))
+    audio_seconds += negative_seconds
+
+    report(
+        {
+            "wake_words": list(wake_word),
+            "threshold": threshold,
+            "inference_framework": inference_framework,
+            "smoothing_blocks": smoothing_blocks,
+            "patience": f"{patience}/{max(patience, patience_window)}",
+            "refractory_ms": refractory_ms,
+            "verifiers": wake.verifiers,
+            "block_ms": block_ms,
+            "audio_seconds": audio_seconds,
+            "real_time_factor": processing_seconds / max(audio_seconds, 1e-9),
+            "block_latency_ms": percentiles(block_latencies),
+            "positives": {
+                "clips": len(positive_files),
+                "detected": detected,
+                "recall": detected / max(1, len(positive_files)),
+                "detection_latency_ms": percentiles(detection_latencies),
+            },
+            "negatives": {
+                "clips": len(negative_files),
+                "hours": negative_seconds / 3600,
+                "false_accepts": false_accepts,
+                "false_accepts_per_hour": false_accepts
+                / max(negative_seconds / 3600, 1e-9),
+            },
+        }
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -91,17 +91,53 @@ def __default_config() -> typing.Dict:
         "name": f"node_{node_id}",
         "area": "",
         "hub_ip": "",
+        "hub_connect_timeout_s": 3,
+        "hub_read_timeout_s": 30,
+        "hub_keepalive_s": 4,
         "wake_word": "ova",
         "wake_word_conf_threshold": 0.8,
         "wakeup_sound": True,
         "vad_sensitivity": 3,
         "vad_threshold": 0.0,
+        "extra_wake_words": {},
+        "inference_framework": "auto",
+        "wake_calibration": {},
+        "onnx_profile": "single",
+        "wake_smoothing_blocks": 1,
+        "wake_patience": 1,
+        "wake_patience_window": 1,
+        "wake_refractory_ms": 0,
+        "wake_verifier": False,
+        "wake_gate_rms": 0,
+        "wake_gate_hangover_ms": 800,
         "speex_noise_suppression": False,
         "speex_available": check_speex(),
         "omni_directional_wake_word": False,
         "mic_index": list_microphones()[0]["idx"],
         "speaker_index": list_speakers()[0]["idx"],
         "volume": 100,
+        "pre_roll_ms": 300,
+        "stream_audio": False,
+        "audio_transport": "auto",
+        "upload_codec": "wav",
+        "save_audio_files": False,
+        "stream_response_audio": True,
+        "response_cache_mb": 8,
+        "response_cache_disk_mb": 0,
+        "pipeline": True,
+        "barge_in": "interrupt",
+        "local_intents": False,
+        "local_intents_min_conf": 0.8,
+        "trace_history": 50,
+        "capture_queue_blocks": 32,
+        "capture_drop_policy": "oldest",
+        "beamforming": True,
+        "endpoint_timeout_ms": 1500,
+        "endpoint_min_hangover_ms": 200,
+        "endpoint_max_hangover_ms": 500,
+        "endpoint_max_utterance_ms": 10000,
+        "trim_command_audio": True,
+        "trim_padding_ms": 200,
     }
 
 
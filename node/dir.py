@@ -6,6 +6,8 @@ BASEDIR = os.path.abspath(
 SOUNDSDIR = os.path.join(BASEDIR, "sounds")
 FILESDIR = os.path.join(BASEDIR, "files")
 WAKEWORDMODELSDIR = os.path.join(BASEDIR, "wakeword_models")
+MODELSDIR = os.path.join(BASEDIR, "models")
+CACHEDIR = os.path.join(BASEDIR, "cache")
 
 LOGSDIR = os.path.join(BASEDIR, "logs")
 LOGFILE = os.path.join(LOGSDIR, "node.log")
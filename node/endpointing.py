@@ -0,0 +1,82 @@
+import collections
+
+
+class Endpointer:
+    # Decides when a command is over from per frame VAD decisions. Everything
+    # is counted in frames so the result only depends on the audio, not on how
+    # quickly the node happens to consume it.
+    #
+    # The hangover (trailing non-speech needed to end the turn) adapts between
+    # min_hangover_ms and max_hangover_ms. Short utterances like "stop" end
+    # after the minimum, while longer ones get more room for pauses between
+    # words. It is scaled by the trailing speech probability, the share of
+    # speech frames just before the pause, so a pause after a run of sporadic
+    # VAD hits ends the turn sooner than one straight after solid speech.
+    def __init__(
+        self,
+        frame_ms: float,
+        timeout_ms: int = 1500,
+        min_hangover_ms: int = 200,
+        max_hangover_ms: int = 500,
+        max_utterance_ms: int = 10000,
+        long_utterance_ms: int = 2000,
+        trailing_window_ms: int = 500,
+    ):
+        self.frame_ms = frame_ms
+        self.timeout_frames = self.frames(timeout_ms)
+        self.min_hangover_frames = self.frames(min_hangover_ms)
+        self.max_hangover_frames = max(
+            self.min_hangover_frames, self.frames(max_hangover_ms)
+        )
+        self.max_utterance_frames = self.frames(max_utterance_ms)
+        self.long_utterance_frames = max(1, self.frames(long_utterance_ms))
+        self.trailing = collections.deque(
+            maxlen=max(1, self.frames(trailing_window_ms))
+        )
+        self.reset()
+
+    def frames(self, ms: float) -> int:
+        return int(round(ms / self.frame_ms))
+
+    def reset(self):
+        self.frame = 0
+        self.speech_frames = 0
+        self.silence_frames = 0
+        self.first_speech_frame = None
+        self.last_speech_frame = None
+        self.hangover_frames = self.min_hangover_frames
+        self.trailing.clear()
+        self.ended = False
+
+    def hangover(self) -> int:
+        length = min(1.0, self.speech_frames / self.long_utterance_frames)
+        trailing_speech = sum(self.trailing) / len(self.trailing)
+        span = self.max_hangover_frames - self.min_hangover_frames
+        return self.min_hangover_frames + int(round(span * length * trailing_speech))
+
+    def update(self, is_speech: bool) -> bool:
+        if self.ended:
+            return True
+        self.frame += 1
+
+        if is_speech:
+            self.speech_frames += 1
+            self.silence_frames = 0
+            if self.first_speech_frame is None:
+                self.first_speech_frame = self.frame
+            self.last_speech_frame = self.frame
+        else:
+            if self.silence_frames == 0 and self.speech_frames:
+                # Fix the hangover for this pause when it starts
+                self.hangover_frames = self.hangover()
+            self.silence_frames += 1
+        self.trailing.append(is_speech)
+
+        if self.frame >= self.max_utterance_frames:
+            self.ended = True
+        elif not self.speech_frames:
+            # Nothing said yet, give up after the timeout
+            self.ended = self.frame >= self.timeout_frames
+        else:
+            self.ended = self.silence_frames >= self.hangover_frames
+        return self.ended
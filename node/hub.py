@@ -0,0 +1,134 @@
+import collections
+import logging
+import threading
+import time
+import typing
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("hub")
+
+from node.utils.stats import latency_stats
+
+# Latencies kept per endpoint for the percentiles in stats()
+LATENCY_HISTORY = 100
+
+
+class HubClient:
+    # One pooled, keep-alive session for every call the node makes to the
+    # HUB. Each call gets a connect and a read timeout, so a HUB that stops
+    # answering fails the interaction instead of hanging the main loop.
+    #
+    # The HUB closes idle connections after a few seconds, when keepalive_s
+    # is set a background thread touches the api root whenever the pool has
+    # been idle that long, so the next command reuses a warm connection
+    # instead of paying for a new handshake.
+    def __init__(
+        self,
+        base_url: str,
+        connect_timeout: float = 3,
+        read_timeout: float = 30,
+        keepalive_s: float = 0,
+        pool_size: int = 4,
+    ):
+        self.base_url = base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_s = keepalive_s
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = threading.Lock()
+        self.latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=LATENCY_HISTORY)
+        )
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+        self.keepalives = 0
+        self.last_used = time.monotonic()
+
+        self.closed = threading.Event()
+        if keepalive_s > 0:
+            threading.Thread(target=self.keep_warm, daemon=True).start()
+
+    def timeout(self, timeout: typing.Optional[float]) -> typing.Tuple:
+        return (self.connect_timeout, timeout or self.read_timeout)
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        endpoint: typing.Optional[str] = None,
+        timeout: typing.Optional[float] = None,
+        **kwargs,
+    ) -> requests.Response:
+        # Calls are counted under endpoint so paths carrying ids or text
+        # share one set of counters
+        endpoint = f"{method} {endpoint or path}"
+        start = time.monotonic()
+        try:
+            response = self.session.request(
+                method,
+                f"{self.base_url}/{path}",
+                timeout=self.timeout(timeout),
+                **kwargs,
+            )
+        except Exception:
+            with self.lock:
+                self.calls[endpoint] += 1
+                self.errors[endpoint] += 1
+            raise
+        finally:
+            self.last_used = time.monotonic()
+        with self.lock:
+            self.calls[endpoint] += 1
+            self.latencies[endpoint].append((self.last_used - start) * 1000)
+        return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def put(self, path: str, **kwargs) -> requests.Response:
+        return self.request("PUT", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def keep_warm(self):
+        while not self.closed.wait(self.keepalive_s / 2):
+            if time.monotonic() - self.last_used < self.keepalive_s:
+                continue
+            try:
+                self.session.get(self.base_url, timeout=self.timeout(5)).close()
+                self.keepalives += 1
+            except Exception as e:
+                logger.debug(f"HUB keepalive failed | {repr(e)}")
+            self.last_used = time.monotonic()
+
+    def close(self):
+        self.closed.set()
+        self.session.close()
+
+    def stats(self) -> typing.Dict:
+        with self.lock:
+            endpoints = {}
+            for endpoint, calls in self.calls.items():
+                latencies = list(self.latencies[endpoint])
+                endpoints[endpoint] = {
+                    "calls": calls,
+                    "errors": self.errors[endpoint],
+                }
+                if latencies:
+                    endpoints[endpoint]["latency_ms"] = latency_stats(latencies)
+        return {
+            "base_url": self.base_url,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "keepalive_s": self.keepalive_s,
+            "keepalives": self.keepalives,
+            "endpoints": endpoints,
+        }
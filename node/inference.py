@@ -0,0 +1,149 @@
+import contextlib
+import logging
+import os
+import typing
+
+import onnxruntime as ort
+
+logger = logging.getLogger("inference")
+
+from node.dir import MODELSDIR
+from node.model_store import checksum
+
+OPTIMIZEDMODELSDIR = os.path.join(MODELSDIR, "optimized")
+
+# Keep a core free for the audio callback and the listener
+SPARE_CORES = 1
+
+SESSION_PROFILES = {
+    "single": {
+        "intra_op_threads": 1,
+        "inter_op_threads": 1,
+        "execution_mode": "sequential",
+        "optimization": "all",
+    },
+    "dual": {
+        "intra_op_threads": 2,
+        "inter_op_threads": 1,
+        "execution_mode": "sequential",
+        "optimization": "all",
+    },
+    "quad": {
+        "intra_op_threads": 4,
+        "inter_op_threads": 1,
+        "execution_mode": "sequential",
+        "optimization": "all",
+    },
+    "parallel": {
+        "intra_op_threads": 1,
+        "inter_op_threads": 2,
+        "execution_mode": "parallel",
+        "optimization": "all",
+    },
+    "extended": {
+        "intra_op_threads": 1,
+        "inter_op_threads": 1,
+        "execution_mode": "sequential",
+        "optimization": "extended",
+    },
+    "basic": {
+        "intra_op_threads": 1,
+        "inter_op_threads": 1,
+        "execution_mode": "sequential",
+        "optimization": "basic",
+    },
+}
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+OPTIMIZATION_LEVELS = {
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+InferenceSession = ort.InferenceSession
+
+
+def available_profiles() -> typing.List[str]:
+    cores = max(1, (os.cpu_count() or 1) - SPARE_CORES)
+    return [
+        name
+        for name, profile in SESSION_PROFILES.items()
+        if name == "single"
+        or max(profile["intra_op_threads"], profile["inter_op_threads"]) <= cores
+    ]
+
+
+def session_options(profile: str) -> ort.SessionOptions:
+    if profile not in SESSION_PROFILES:
+        raise RuntimeError(f"Unknown session profile: {profile}")
+    settings = SESSION_PROFILES[profile]
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = settings["intra_op_threads"]
+    options.inter_op_num_threads = settings["inter_op_threads"]
+    options.execution_mode = EXECUTION_MODES[settings["execution_mode"]]
+    options.graph_optimization_level = OPTIMIZATION_LEVELS[settings["optimization"]]
+    return options
+
+
+class SessionFactory:
+    # Creates onnxruntime sessions with a session profile instead of the
+    # defaults openWakeWord picks. The first load of a model writes its
+    # optimized graph to the cache, later loads read that file back with
+    # optimization turned off. The cache is keyed on the model checksum,
+    # profile and onnxruntime version, since an optimized graph is specific
+    # to all three and to the board it was made on.
+    def __init__(self, profile: str = "single", cache_dir: str = OPTIMIZEDMODELSDIR):
+        session_options(profile)
+        self.profile = profile
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def cached_path(self, model_path: str) -> str:
+        name = os.path.splitext(os.path.basename(model_path))[0]
+        return os.path.join(
+            self.cache_dir,
+            f"{name}.{self.profile}.{ort.__version__}.{checksum(model_path)[:16]}.onnx",
+        )
+
+    def __call__(self, model_path: str, *args, **kwargs) -> ort.InferenceSession:
+        # Matches the InferenceSession signature, the options and providers
+        # passed in are replaced by the profile
+        cached = self.cached_path(model_path)
+        if os.path.exists(cached):
+            options = session_options(self.profile)
+            options.graph_optimization_level = (
+                ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            )
+            try:
+                session = InferenceSession(
+                    cached, sess_options=options, providers=["CPUExecutionProvider"]
+                )
+                self.cache_hits += 1
+                return session
+            except Exception as e:
+                logger.warning(f"Discarding optimized model {cached} | {repr(e)}")
+                os.remove(cached)
+
+        options = session_options(self.profile)
+        options.optimized_model_filepath = cached
+        self.cache_misses += 1
+        return InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+
+    @contextlib.contextmanager
+    def patch(self):
+        # openWakeWord builds its sessions inside Model and VAD, stand in for
+        # InferenceSession while they are constructed
+        ort.InferenceSession = self
+        try:
+            yield self
+        finally:
+            ort.InferenceSession = InferenceSession
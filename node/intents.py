@@ -0,0 +1,116 @@
+import collections
+import json
+import logging
+import os
+import time
+import typing
+import zipfile
+
+import numpy as np
+
+logger = logging.getLogger("intents")
+
+from node import config
+from node.dir import MODELSDIR
+from node.model_store import ModelStore
+from node.utils.stats import latency_stats
+
+VOSK_MODEL_URL = "https://alphacephei.com/vosk/models/vosk-model-small-en-us-0.15.zip"
+
+# Phrases the node can act on by itself, anything else goes to the HUB
+INTENTS = {
+    "stop": "stop",
+    "cancel timer": "stop_timer",
+    "cancel the timer": "stop_timer",
+    "stop timer": "stop_timer",
+    "stop the timer": "stop_timer",
+    "volume up": "volume_up",
+    "volume down": "volume_down",
+}
+
+VOLUME_STEP = 10
+
+
+class LocalIntents:
+    # Small vocabulary recognizer for the handful of commands the node
+    # implements itself. The grammar holds only the intent phrases plus
+    # [unk], so decoding is cheap enough to run on each block as the command
+    # is captured and the result is ready right at the endpoint. A command
+    # is only taken locally when the whole utterance is one phrase and every
+    # word clears min_conf.
+    def __init__(self, node, sample_rate: int, min_conf: float = 0.8):
+        from vosk import KaldiRecognizer, Model, SetLogLevel
+
+        SetLogLevel(-1)
+        self.node = node
+        self.min_conf = min_conf
+        model = Model(self.model_path())
+        self.recognizer = KaldiRecognizer(
+            model, sample_rate, json.dumps([*INTENTS, "[unk]"])
+        )
+        self.recognizer.SetWords(True)
+
+        self.handled = collections.Counter()
+        self.fallthroughs = 0
+        self.decode_ms = collections.deque(maxlen=100)
+        self.decode_s = 0.0
+
+    def model_path(self) -> str:
+        name = os.path.splitext(os.path.basename(VOSK_MODEL_URL))[0]
+        path = os.path.join(MODELSDIR, name)
+        if not os.path.isdir(path):
+            archive = ModelStore().fetch(VOSK_MODEL_URL)
+            logger.info(f"Extracting {os.path.basename(archive)}")
+            with zipfile.ZipFile(archive) as model_zip:
+                model_zip.extractall(MODELSDIR)
+        return path
+
+    def start(self):
+        self.recognizer.Reset()
+        self.decode_s = 0.0
+
+    def feed(self, chunk: bytes):
+        start = time.monotonic()
+        self.recognizer.AcceptWaveform(bytes(chunk))
+        self.decode_s += time.monotonic() - start
+
+    def finish(self) -> typing.Optional[str]:
+        start = time.monotonic()
+        result = json.loads(self.recognizer.FinalResult())
+        self.decode_s += time.monotonic() - start
+        self.decode_ms.append(self.decode_s * 1000)
+
+        words = result.get("result", [])
+        # Noise or the tail of the wake word ahead of the command is fine
+        while words and words[0]["word"] == "[unk]":
+            words.pop(0)
+        phrase = " ".join(word["word"] for word in words)
+        intent = INTENTS.get(phrase)
+        if intent and all(word["conf"] >= self.min_conf for word in words):
+            logger.info(f"Local intent: {intent} ({phrase})")
+            return intent
+        self.fallthroughs += 1
+        return None
+
+    def handle(self, intent: str):
+        self.handled[intent] += 1
+        if intent == "stop":
+            self.node.audio_player.interrupt()
+        elif intent == "stop_timer":
+            self.node.stop_timer()
+            self.node.audio_player.interrupt()
+        elif intent in ["volume_up", "volume_down"]:
+            step = VOLUME_STEP if intent == "volume_up" else -VOLUME_STEP
+            volume = int(np.clip(config.get("volume") + step, 0, 100))
+            config.set("volume", volume)
+            self.node.set_volume(volume)
+
+    def stats(self) -> typing.Dict:
+        decode_ms = list(self.decode_ms)
+        stats = {
+            "handled": dict(self.handled),
+            "fallthroughs": self.fallthroughs,
+        }
+        if decode_ms:
+            stats["decode_ms"] = latency_stats(decode_ms)
+        return stats
@@ -1,27 +1,51 @@
 import logging
 import os
-import queue
 import time
+import typing
 import wave
 
-import sounddevice as sd
 import webrtcvad
 
 logger = logging.getLogger("listener")
 
 from node.dir import FILESDIR, SOUNDSDIR
+from node.endpointing import Endpointer
+from node.inference import SessionFactory
+from node.intents import LocalIntents
+from node.trace import Trace
+from node.utils.beamforming import RESPEAKER_4MIC, Beamformer
+from node.utils.resample import Resampler
+from node.utils.ring_buffer import RingBuffer
 from node.wake import OpenWakeWord
 
 
 class Listener:
-    def __init__(self, node, frames_per_buffer: int = 1280):
+    def __init__(self, node):
         self.node = node
-        self.mic_idx = node.mic_idx
         self.sample_rate = node.sample_rate
         self.sample_width = node.sample_width
         self.channels = node.audio_channels
-        self.frames_per_buffer = frames_per_buffer
+        self.frames_per_buffer = node.frames_per_buffer
+        self.beamformer = None
+        if node.capture_channels > 1:
+            self.beamformer = Beamformer(node.capture_rate, RESPEAKER_4MIC)
+        self.resampler = Resampler(node.capture_rate, self.sample_rate)
         self.wakeup_sound = node.wakeup_sound
+        self.save_audio_files = node.save_audio_files
+        self.wake_word = None
+        # Callback sent with the command being captured when it answers a
+        # follow up question
+        self.hub_callback = ""
+        # Monotonic time the endpointer closed the last command
+        self.endpoint_time = None
+        self.captured_at = None
+        self.trace = None
+        self.capturing = False
+        # Time spent able to hear a wake word, against time spent capturing
+        # commands, for the wake availability in stats()
+        self.started = time.monotonic()
+        self.wake_listening_s = 0.0
+        self.capturing_s = 0.0
         self.noise_suppression = None
         if node.speex_noise_suppression:
             from speexdsp_ns import NoiseSuppression
@@ -31,178 +55,342 @@ class Listener:
             )
 
         self.wake = OpenWakeWord(
-            wake_word=node.wake_word,
-            wake_word_conf_threshold=node.wake_word_conf_threshold,
+            wake_words=node.wake_words,
             # set this to false if using omni-directional wake word so to not double up noise supression
             speex_noise_suppression=node.speex_noise_suppression
             if not node.omni_directional_wake_word
             else False,
             vad_threshold=node.vad_threshold,
+            inference_framework=node.inference_framework,
+            gate_rms=node.wake_gate_rms,
+            gate_hangover_ms=node.wake_gate_hangover_ms,
+            sessions=SessionFactory(node.onnx_profile),
+            smoothing_blocks=node.wake_smoothing_blocks,
+            patience=node.wake_patience,
+            patience_window=node.wake_patience_window,
+            refractory_ms=node.wake_refractory_ms,
+            verifier=node.wake_verifier,
         )
 
+        self.intents = None
+        self.intent = None
+        if node.local_intents:
+            try:
+                self.intents = LocalIntents(
+                    node, self.sample_rate, node.local_intents_min_conf
+                )
+            except Exception:
+                logger.exception("Failed to load local intents")
+
         self.vad = webrtcvad.Vad()
         self.vad.set_mode(node.vad_sensitivity)
 
         self.vad_chunk_size = 960  # 30ms
+        self.frames_past_end = 0
+        self.vad_buffer = RingBuffer(
+            self.frames_per_buffer * self.sample_width * self.channels
+            + self.vad_chunk_size,
+            frame_size=self.vad_chunk_size,
+        )
+
+        vad_frame_ms = (
+            self.vad_chunk_size / (self.sample_width * self.channels) / self.sample_rate
+        ) * 1000
+        self.endpointer = Endpointer(
+            vad_frame_ms,
+            timeout_ms=node.endpoint_timeout_ms,
+            min_hangover_ms=node.endpoint_min_hangover_ms,
+            max_hangover_ms=node.endpoint_max_hangover_ms,
+            max_utterance_ms=node.endpoint_max_utterance_ms,
+        )
+
+        self.trim_command_audio = node.trim_command_audio
+        self.trim_padding = (
+            int(self.sample_rate * node.trim_padding_ms / 1000)
+            * self.sample_width
+            * self.channels
+        )
+
+        # Rolling capture of the audio leading up to the command so the onset
+        # is not clipped while the wake word or VAD is still deciding
+        frame_size = self.sample_width * self.channels
+        self.pre_roll = RingBuffer(
+            int(self.sample_rate * node.pre_roll_ms / 1000) * frame_size,
+            frame_size=frame_size,
+        )
+
+    def save_command(self, command_audio: bytes):
+        with wave.open(os.path.join(FILESDIR, "command.wav"), "wb") as wav_file:
+            wav_file.setframerate(self.sample_rate)
+            wav_file.setsampwidth(self.sample_width)
+            wav_file.setnchannels(self.channels)
+            wav_file.writeframes(command_audio)
+        self.trace.mark("command_saved")
+
+    def read(self, buffer) -> bytes:
+        chunk = buffer.get()
+        self.captured_at = buffer.captured_at
+        if self.beamformer:
+            chunk = self.beamformer.process(chunk)
+        return self.resampler.process(chunk)
+
+    def detect_speech(self, chunk: bytes) -> typing.List[bool]:
+        self.vad_buffer.write(chunk)
+        # Process in chunks of 30ms for webrtcvad
+        return [
+            self.vad.is_speech(vad_chunk, self.sample_rate)
+            for vad_chunk in self.vad_buffer.frames()
+        ]
+
+    def end_of_turn(self, speech: typing.List[bool]) -> bool:
+        # The endpointer stops counting once it has ended, frames after that
+        # in the same chunk are still trailing audio for trim()
+        ended = [self.endpointer.update(is_speech) for is_speech in speech]
+        self.frames_past_end = max(0, ended.count(True) - 1)
+        return any(ended)
+
+    def speech_onset(self, audio: bytes, end: int) -> int:
+        # Start of the run of speech that reaches end. VAD goes forwards over
+        # the frames, its onsets are sharp while its offsets have hangover.
+        start = end % self.vad_chunk_size
+        for offset in range(start, end, self.vad_chunk_size):
+            frame = bytes(audio[offset : offset + self.vad_chunk_size])
+            if not self.vad.is_speech(frame, self.sample_rate):
+                start = offset + self.vad_chunk_size
+        return start
+
+    def trim(self, command_audio: bytes, command_start: int = None) -> bytes:
+        # Cut the command down to the speech the endpointer saw plus padding.
+        # command_start is the byte offset of the endpointer's first frame,
+        # when it is known the wake word and any lead-in silence go as well.
+        if not self.trim_command_audio or self.endpointer.last_speech_frame is None:
+            return command_audio
+        if command_start is None:
+            # Frames VAD has seen past the endpoint count as trailing silence
+            trailing = (
+                self.endpointer.frame
+                - self.endpointer.last_speech_frame
+                + self.frames_past_end
+            ) * self.vad_chunk_size + len(self.vad_buffer)
+            start = 0
+            end = len(command_audio) - trailing
+        else:
+            if self.endpointer.first_speech_frame == 1:
+                # Speech was already going when the endpointer started, find
+                # where it began in the pre-roll instead of cutting it off
+                start = self.speech_onset(command_audio, command_start)
+            else:
+                first = self.endpointer.first_speech_frame - 1
+                start = command_start + first * self.vad_chunk_size
+            end = (
+                command_start + self.endpointer.last_speech_frame * self.vad_chunk_size
+            )
+        start = max(0, start - self.trim_padding)
+        end = min(len(command_audio), end + self.trim_padding)
+        logger.debug(f"Trimmed command audio to {start}:{end} of {len(command_audio)}")
+        return command_audio[start:end]
+
+    def earcon(self, sound: str):
+        # Under the queue policy earlier responses still have to be heard,
+        # playing a sound would cut them off
+        if not self.wakeup_sound or self.node.processor.queueing():
+            return
+        # Replaces the previous earcon, a response still playing is left to
+        # barge_in
+        self.node.audio_player.stop_sounds()
+        self.node.audio_player.play_audio_file(
+            os.path.join(SOUNDSDIR, sound), asynchronous=True
+        )
 
-        self.engaged_delay = 1  # seconds
+    def end_command(self, stream):
+        # A command the node handles itself never reaches the HUB, aborting
+        # drops the upload before the HUB sees a complete body
+        self.trace.mark("endpoint_audio", self.captured_at)
+        self.trace.mark("endpoint", self.endpoint_time)
+        self.intent = self.intents.finish() if self.intents else None
+        if self.intents:
+            self.trace.mark("intent_decided")
+        if self.intent:
+            self.trace.set(intent=self.intent)
+            self.node.processor.abort_stream()
+        elif stream:
+            stream.close()
 
-    def listen(self):
+    def listen(self) -> bytes:
         self.wake.reset()
-        buffer = queue.Queue()
+        self.resampler.reset()
+        if self.beamformer:
+            self.beamformer.reset()
+        self.pre_roll.clear()
+        self.wake_word = None
+        self.intent = None
+        self.trace = None
+        self.hub_callback = ""
         logger.info("Listening...")
 
-        def callback(indata, frames, time, status):
-            buffer.put(bytes(indata))
-
-        with sd.InputStream(
-            samplerate=self.sample_rate,
-            device=self.mic_idx,
-            channels=self.channels,
-            blocksize=self.frames_per_buffer,
-            callback=callback,
-            dtype="int16",
-        ):
-            if not self.node.engaged:
-                while self.node.running.is_set():
-                    chunk = buffer.get()
-                    if self.wake.listen_for_wake_word(chunk):
-                        logger.info("Wake word!")
-                        break
+        with self.node.microphone.session() as buffer:
+            listen_start = time.monotonic()
+            # A response asking a follow up question engages the node once it
+            # has played, which can happen while waiting here
+            while self.node.running.is_set() and not self.node.engaged:
+                chunk = self.read(buffer)
+                self.pre_roll.write(chunk)
+                self.wake_word = self.wake.listen_for_wake_word(chunk, self.captured_at)
+                if self.wake_word:
+                    logger.info(f"Wake word! ({self.wake_word})")
+                    break
+            capture_start = time.monotonic()
+            self.wake_listening_s += capture_start - listen_start
+            self.capturing = True
+            # Either way this capture uses up the follow up, a wake word
+            # starts a new command instead of answering it
+            hub_callback = self.node.processor.take_follow_up()
+            if not self.wake_word:
+                self.hub_callback = hub_callback
+                # The pre-roll holds the end of the response that asked the
+                # follow up, not the user
+                self.pre_roll.clear()
+            self.trace = Trace(self.wake_word)
+            if self.wake_word:
+                self.trace.mark("wake_audio", self.captured_at)
+                self.trace.mark("wake_detected", capture_start)
+            else:
+                self.trace.mark("follow_up_start", capture_start)
 
-            self.node.audio_player.interrupt()
+            self.node.processor.barge_in()
             if self.node.led_controller:
-                self.node.led_controller.listen()
-
-            if self.wakeup_sound:
-                self.node.audio_player.play_audio_file(
-                    os.path.join(SOUNDSDIR, "activate.wav"), asynchronous=True
+                self.node.led_controller.listen(
+                    self.beamformer.direction if self.beamformer else None
                 )
 
-            with wave.open(os.path.join(FILESDIR, "command.wav"), "wb") as wav_file:
-                wav_file.setframerate(self.sample_rate)
-                wav_file.setsampwidth(self.sample_width)
-                wav_file.setnchannels(self.channels)
+            self.earcon("activate.wav")
 
-                start = time.time()
-                not_speech_start_time = None
-                vad_audio_data = bytes()
-                while self.node.running.is_set():
-                    chunk = buffer.get()
-                    if chunk:
-                        if self.noise_suppression:
-                            chunk = self.noise_suppression.process(chunk)
-                        wav_file.writeframes(chunk)
-
-                        vad_audio_data += chunk
-                        is_speech = False
-
-                        # Process in chunks of 30ms for webrtcvad
-                        while (
-                            len(vad_audio_data) >= self.vad_chunk_size
-                            and self.node.running.is_set()
-                        ):
-                            vad_chunk = vad_audio_data[: self.vad_chunk_size]
-                            vad_audio_data = vad_audio_data[self.vad_chunk_size :]
-
-                            # Speech in any chunk counts as speech
-                            is_speech = is_speech or self.vad.is_speech(
-                                vad_chunk, self.sample_rate
-                            )
+            command_audio = bytearray()
+            stream = self.node.processor.start_stream()
+            for segment in self.pre_roll.segments():
+                command_audio += segment
+                if stream:
+                    stream.write(segment)
+
+            # The endpointer's first frame starts right after the wake word
+            command_start = len(command_audio)
+            self.vad_buffer.clear()
+            self.endpointer.reset()
+            if self.intents:
+                self.intents.start()
+            while self.node.running.is_set():
+                chunk = self.read(buffer)
+                if chunk:
+                    if self.noise_suppression:
+                        chunk = self.noise_suppression.process(bytes(chunk))
+                    command_audio += chunk
+                    if stream:
+                        stream.write(chunk)
+                    if self.intents:
+                        self.intents.feed(chunk)
 
-                        if (
-                            time.time() - start < self.engaged_delay
-                        ):  # If we are engaged, wait a few seconds to hear something
-                            is_speech = True
-                        elif not is_speech:
-                            if not not_speech_start_time:
-                                not_speech_start_time = time.time()
-                            elif (
-                                time.time() - not_speech_start_time > 0.5
-                            ):  # Make sure we get at least .5 seconds of no speech
-                                if self.wakeup_sound:
-                                    self.node.audio_player.interrupt()
-                                    self.node.audio_player.play_audio_file(
-                                        os.path.join(SOUNDSDIR, "deactivate.wav"),
-                                        asynchronous=True,
-                                    )
-                                return
-
-    def listen_omni_directional(self):
+                    if self.end_of_turn(self.detect_speech(chunk)):
+                        self.endpoint_time = time.monotonic()
+                        self.end_command(stream)
+                        self.earcon("deactivate.wav")
+                        command_audio = self.trim(command_audio, command_start)
+                        if self.save_audio_files:
+                            self.save_command(command_audio)
+                        self.capturing = False
+                        self.capturing_s += time.monotonic() - capture_start
+                        return command_audio
+
+            self.capturing = False
+            self.node.processor.abort_stream()
+
+    def listen_omni_directional(self) -> bytes:
         self.wake.reset()
-        buffer = queue.Queue()
-        wake_word_detected = False
+        self.resampler.reset()
+        if self.beamformer:
+            self.beamformer.reset()
+        self.wake_word = None
+        self.trace = None
+        self.hub_callback = ""
         logger.info("Listening...")
 
-        def callback(indata, frames, time, status):
-            buffer.put(bytes(indata))
-
-        with sd.InputStream(
-            samplerate=self.sample_rate,
-            device=self.mic_idx,
-            channels=self.channels,
-            blocksize=self.frames_per_buffer,
-            callback=callback,
-            dtype="int16",
-        ):
+        # The wake word model runs through the whole command in this mode
+        listen_start = time.monotonic()
+        with self.node.microphone.session() as buffer:
             while self.node.running.is_set():
                 audio_data = []
+                stream = None
+                streamed = 0
                 speech_started = False
-                not_speech_start_time = None
-                vad_audio_data = bytes()
+                self.vad_buffer.clear()
+                self.pre_roll.clear()
                 while self.node.running.is_set():
-                    chunk = buffer.get()
+                    chunk = self.read(buffer)
                     if chunk:
                         if self.noise_suppression:
-                            chunk = self.noise_suppression.process(chunk)
-
-                        vad_audio_data += chunk
-                        is_speech = False
-
-                        # Process in chunks of 30ms for webrtcvad
-                        while (
-                            len(vad_audio_data) >= self.vad_chunk_size
-                            and self.node.running.is_set()
-                        ):
-                            vad_chunk = vad_audio_data[: self.vad_chunk_size]
-                            vad_audio_data = vad_audio_data[self.vad_chunk_size :]
-
-                            # Speech in any chunk counts as speech
-                            is_speech = is_speech or self.vad.is_speech(
-                                vad_chunk, self.sample_rate
-                            )
+                            chunk = self.noise_suppression.process(bytes(chunk))
+
+                        speech = self.detect_speech(chunk)
 
-                        if not wake_word_detected and self.wake.listen_for_wake_word(
-                            chunk
-                        ):
-                            logger.info("Wake word!")
-                            wake_word_detected = True
+                        if not self.wake_word:
+                            self.wake_word = self.wake.listen_for_wake_word(
+                                chunk, self.captured_at
+                            )
+                            if self.wake_word:
+                                logger.info(f"Wake word! ({self.wake_word})")
+                                self.hub_callback = self.node.processor.take_follow_up()
+                                self.trace = Trace(self.wake_word)
+                                self.trace.mark("wake_audio", self.captured_at)
+                                self.trace.mark("wake_detected")
+                                self.node.processor.barge_in()
+                                stream = self.node.processor.start_stream()
 
-                        if is_speech:
-                            speech_started = True
+                        if not speech_started:
+                            if any(speech):
+                                speech_started = True
+                                self.endpointer.reset()
+                                audio_data.extend(
+                                    bytes(segment)
+                                    for segment in self.pre_roll.segments()
+                                )
+                                if self.intents:
+                                    self.intents.start()
+                                    for data in audio_data:
+                                        self.intents.feed(data)
+                            else:
+                                self.pre_roll.write(chunk)
                         if speech_started:
-                            audio_data.append(chunk)
-                            if not is_speech:
-                                if not not_speech_start_time:
-                                    not_speech_start_time = time.time()
-                                elif (
-                                    time.time() - not_speech_start_time > 0.5
-                                ):  # Make sure we get at least .5 seconds of no speech
-                                    if not wake_word_detected:
-                                        break
-                                    if self.wakeup_sound:
-                                        self.node.audio_player.interrupt()
-                                        self.node.audio_player.play_audio_file(
-                                            os.path.join(SOUNDSDIR, "deactivate.wav"),
-                                            asynchronous=True,
-                                        )
-
-                                    with wave.open(
-                                        os.path.join(FILESDIR, "command.wav"), "wb"
-                                    ) as wav_file:
-                                        wav_file.setframerate(self.sample_rate)
-                                        wav_file.setsampwidth(self.sample_width)
-                                        wav_file.setnchannels(self.channels)
-                                        for chunk in audio_data:
-                                            wav_file.writeframes(chunk)
-                                    return
+                            # Capture blocks are recycled, keep a copy
+                            audio_data.append(bytes(chunk))
+                            if self.intents:
+                                self.intents.feed(chunk)
+                            if stream:
+                                # Catch the upload up with everything captured so far
+                                for data in audio_data[streamed:]:
+                                    stream.write(data)
+                                streamed = len(audio_data)
+                            if self.end_of_turn(speech):
+                                if not self.wake_word:
+                                    break
+                                self.endpoint_time = time.monotonic()
+                                self.end_command(stream)
+                                self.earcon("deactivate.wav")
+
+                                # Capture starts at the speech onset already,
+                                # only the trailing silence goes
+                                command_audio = self.trim(b"".join(audio_data))
+                                if self.save_audio_files:
+                                    self.save_command(command_audio)
+                                self.wake_listening_s += time.monotonic() - listen_start
+                                return command_audio
+
+            self.node.processor.abort_stream()
+
+    def stats(self) -> dict:
+        awake = time.monotonic() - self.started - self.capturing_s
+        return {
+            "wake_listening_s": round(self.wake_listening_s, 3),
+            "capturing_s": round(self.capturing_s, 3),
+            "wake_availability": round(self.wake_listening_s / awake, 4)
+            if awake > 0
+            else None,
+        }
@@ -0,0 +1,169 @@
+import collections
+import contextlib
+import logging
+import queue
+import threading
+import time
+import typing
+
+import sounddevice as sd
+
+logger = logging.getLogger("microphone")
+
+from node.trace import stream_to_monotonic
+
+
+class CaptureQueue:
+    # Bounded handoff from the audio callback to one listen session. Blocks
+    # come from a preallocated pool and go back to it once the consumer asks
+    # for the next one, so a block returned by get() is only valid until the
+    # following get(). When the consumer falls behind, the drop policy picks
+    # which block to lose instead of letting the backlog grow.
+    def __init__(self, block_size: int, max_blocks: int, drop_policy: str):
+        if drop_policy not in ["oldest", "newest"]:
+            raise RuntimeError(f"Unknown drop policy: {drop_policy}")
+        self.drop_policy = drop_policy
+        self.pool = collections.deque(
+            bytearray(block_size) for _ in range(max_blocks + 2)
+        )
+        self.blocks = queue.Queue(max_blocks)
+        self.current = None
+        # Monotonic time the last sample of the current block was captured
+        self.captured_at = None
+        self.received = 0
+        self.drops = 0
+        self.max_depth = 0
+
+    def put(self, indata, captured_at: float):
+        self.received += 1
+        if self.blocks.full():
+            self.drops += 1
+            if self.drop_policy == "newest":
+                return
+            try:
+                self.pool.append(self.blocks.get_nowait()[0])
+            except queue.Empty:
+                pass
+        try:
+            block = self.pool.popleft()
+        except IndexError:
+            self.drops += 1
+            return
+        block[:] = memoryview(indata).cast("B")
+        self.blocks.put_nowait((block, captured_at))
+        self.max_depth = max(self.max_depth, self.blocks.qsize())
+
+    def get(self, timeout: float = None) -> bytearray:
+        if self.current is not None:
+            self.pool.append(self.current)
+            self.current = None
+        self.current, self.captured_at = self.blocks.get(timeout=timeout)
+        return self.current
+
+    def stats(self) -> typing.Dict:
+        return {
+            "depth": self.blocks.qsize(),
+            "max_depth": self.max_depth,
+            "capacity": self.blocks.maxsize,
+            "received": self.received,
+            "drops": self.drops,
+        }
+
+
+class Microphone:
+    # A single input stream kept open for the lifetime of the node. Listen
+    # sessions subscribe to it instead of reopening the device, so follow up
+    # turns start on the next block instead of after a device open.
+    def __init__(
+        self,
+        mic_idx: int,
+        sample_rate: int,
+        channels: int,
+        frames_per_buffer: int,
+        queue_blocks: int = 32,
+        drop_policy: str = "oldest",
+    ):
+        self.mic_idx = mic_idx
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames_per_buffer = frames_per_buffer
+        self.block_size = frames_per_buffer * channels * 2
+        self.queue_blocks = queue_blocks
+        self.drop_policy = drop_policy
+        self.subscribers = ()
+        self.lock = threading.Lock()
+        self.stream = None
+        self.open_time = None
+
+        self.blocks = 0
+        self.input_overflows = 0
+        self.input_underflows = 0
+        self.session_drops = 0
+
+    def start(self):
+        start = time.perf_counter()
+        self.stream = sd.InputStream(
+            samplerate=self.sample_rate,
+            device=self.mic_idx,
+            channels=self.channels,
+            blocksize=self.frames_per_buffer,
+            callback=self.callback,
+            dtype="int16",
+        )
+        self.stream.start()
+        self.open_time = time.perf_counter() - start
+        logger.info(f"Microphone opened in {self.open_time * 1000:.1f}ms")
+
+    def stop(self):
+        if self.stream:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def callback(self, indata, frames, time_info, status):
+        self.blocks += 1
+        # Some drivers leave the ADC time at zero, fall back to the callback
+        captured_at = time.monotonic()
+        if time_info.inputBufferAdcTime:
+            captured_at = stream_to_monotonic(
+                time_info.inputBufferAdcTime + frames / self.sample_rate,
+                time_info.currentTime,
+            )
+        if status.input_overflow:
+            self.input_overflows += 1
+        if status.input_underflow:
+            self.input_underflows += 1
+        for subscriber in self.subscribers:
+            subscriber.put(indata, captured_at)
+
+    def subscribe(self) -> CaptureQueue:
+        subscriber = CaptureQueue(self.block_size, self.queue_blocks, self.drop_policy)
+        with self.lock:
+            # Swap in a new tuple so the audio callback never takes the lock
+            self.subscribers = self.subscribers + (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber: CaptureQueue):
+        with self.lock:
+            self.subscribers = tuple(s for s in self.subscribers if s is not subscriber)
+            self.session_drops += subscriber.drops
+
+    def stats(self) -> typing.Dict:
+        subscribers = self.subscribers
+        return {
+            "open_ms": self.open_time * 1000 if self.open_time else None,
+            "blocks": self.blocks,
+            "input_overflows": self.input_overflows,
+            "input_underflows": self.input_underflows,
+            "drops": self.session_drops + sum(s.drops for s in subscribers),
+            "drop_policy": self.drop_policy,
+            "sessions": [s.stats() for s in subscribers],
+        }
+
+    @contextlib.contextmanager
+    def session(self) -> typing.Iterator[CaptureQueue]:
+        subscriber = self.subscribe()
+        try:
+            yield subscriber
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import typing
+
+import openwakeword
+import requests
+
+logger = logging.getLogger("model_store")
+
+from node.dir import BASEDIR, MODELSDIR
+
+# Known good openWakeWord feature models, the same files ship in the
+# openWakeWord 0.5 wheels and the v0.5.1 release
+PINNED_CHECKSUMS = {
+    "melspectrogram.onnx": "ba2b0e0f8b7b875369a2c89cb13360ff53bac436f2895cced9f479fa65eb176f",
+    "melspectrogram.tflite": "96fa0adccb6e8cf95cb14465409a1a2898ee4a96a85bb9ed3c7eb0e68bf163e8",
+    "embedding_model.onnx": "70d164290c1d095d1d4ee149bc5e00543250a7316b59f31d056cff7bd3075c1f",
+    "embedding_model.tflite": "c0aea21eb84a4ce90a08c870da41b7a7173b45269e6a3207c71d67c40f3a59d8",
+    "silero_vad.onnx": "a35ebf52fd3ce5f1469b2a36158dba761bc47b973ea3382b3186ca15b1f5af28",
+}
+
+
+def checksum(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as model_file:
+        for block in iter(lambda: model_file.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class ModelStore:
+    # Local copies of the openWakeWord feature models plus a sha256 manifest
+    # covering them and the wake word models. Startup only verifies files
+    # against the manifest, the network is touched only to fetch a feature
+    # model that is missing or fails its checksum. Feature models are checked
+    # against PINNED_CHECKSUMS rather than trusted on first sight.
+    def __init__(self, directory: str = MODELSDIR):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as manifest_file:
+                self.manifest = json.load(manifest_file)
+        self.downloads = 0
+
+    def key(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), BASEDIR)
+
+    def save(self):
+        with open(self.manifest_path, "w") as manifest_file:
+            manifest_file.write(json.dumps(self.manifest, indent=4))
+
+    def expected(self, path: str) -> typing.Optional[str]:
+        return PINNED_CHECKSUMS.get(os.path.basename(path)) or self.manifest.get(
+            self.key(path)
+        )
+
+    def register(self, path: str):
+        self.manifest[self.key(path)] = checksum(path)
+        self.save()
+
+    def verify(self, path: str) -> bool:
+        expected = self.expected(path)
+        return (
+            expected is not None and os.path.exists(path) and checksum(path) == expected
+        )
+
+    def fetch(self, url: str) -> str:
+        filename = url.split("/")[-1]
+        path = os.path.join(self.directory, filename)
+        if os.path.exists(path) and self.expected(path) is None:
+            # Copied into the store by hand
+            self.register(path)
+        if self.verify(path):
+            if self.key(path) not in self.manifest:
+                self.register(path)
+            return path
+
+        # Nodes that used to call download_models() already have a copy
+        # inside the openWakeWord package
+        package_path = os.path.join(
+            os.path.dirname(openwakeword.__file__), "resources", "models", filename
+        )
+        if os.path.exists(package_path):
+            logger.info(f"Copying {filename} into the model store")
+            shutil.copyfile(package_path, path)
+            if self.verify(path):
+                self.register(path)
+                return path
+            logger.warning(f"{package_path} failed checksum")
+
+        logger.info(f"Downloading {url}")
+        partial = f"{path}.part"
+        with requests.get(url, stream=True, timeout=(5, 30)) as response:
+            response.raise_for_status()
+            with open(partial, "wb") as model_file:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    model_file.write(chunk)
+        self.downloads += 1
+        pinned = PINNED_CHECKSUMS.get(filename)
+        if pinned and checksum(partial) != pinned:
+            os.remove(partial)
+            raise RuntimeError(f"Downloaded model failed checksum: {url}")
+        os.replace(partial, path)
+        self.register(path)
+        return path
+
+    def feature_models(self, inference_framework: str) -> typing.Dict[str, str]:
+        extension = f".{inference_framework}"
+        paths = {
+            name: self.fetch(model["download_url"].replace(".tflite", extension))
+            for name, model in openwakeword.FEATURE_MODELS.items()
+        }
+        # Silero VAD only ships as ONNX
+        paths["vad"] = self.fetch(openwakeword.VAD_MODELS["silero_vad"]["download_url"])
+        return paths
+
+    def verify_wake_word(self, path: str):
+        # Wake word models are shipped or uploaded, not downloaded. A model
+        # seen for the first time is trusted and recorded, after that it has
+        # to match, uploads register the new checksum themselves.
+        if self.key(path) not in self.manifest:
+            self.register(path)
+        elif not self.verify(path):
+            raise RuntimeError(f"Wake word model failed checksum: {path}")
@@ -1,61 +1,362 @@
+import collections
 import logging
 import os
+import queue
+import threading
 import time
 
+import numpy as np
 import requests
 
 logger = logging.getLogger("processor")
 
 from node.dir import FILESDIR
+from node.hub import HubClient
+from node.trace import Trace
+from node.utils.codecs import encode_audio
+from node.utils.stats import latency_stats
+from node.utils.transport import (
+    ACCEPT_AUDIO,
+    UNSUPPORTED_STATUS_CODES,
+    audio_request_headers,
+    is_audio,
+    read_audio_context,
+    read_audio_response,
+)
 
+# Small reads so playback starts on the first bytes the HUB sends
+RESPONSE_CHUNK_BYTES = 1024
 
-class Processor:
-    def __init__(self, node):
-        self.node = node
 
-        self.hub_callback = ""
+class AudioStream:
+    # Uploads raw PCM to the HUB with chunked transfer encoding while the
+    # command is still being captured
+    def __init__(self, hub: HubClient, headers: dict, time_sent: float):
+        self.hub = hub
+        self.headers = headers
+        self.time_sent = time_sent
+        self.chunks = queue.Queue()
+        self.response = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
 
-    def process_audio(self):
-        logger.info("Sending audio data to HUB for processing")
+    def start(self):
+        self.thread.start()
 
-        if self.node.led_controller:
-            self.node.led_controller.think()
+    def write(self, chunk: bytes):
+        self.chunks.put(bytes(chunk))
 
-        self.node.engaged = False
+    def close(self):
+        self.chunks.put(None)
 
-        time_sent = time.time()
+    def abort(self):
+        self.chunks.put(False)
+
+    def iter_chunks(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+            if chunk is False:
+                # Raising mid-body drops the connection so the HUB never
+                # processes a partial command
+                raise RuntimeError("Audio stream aborted")
+            yield chunk
+
+    def run(self):
         try:
-            command_audio_data = open(
-                os.path.join(FILESDIR, "command.wav"), "rb"
-            ).read()
-        except:
-            logger.error("No command audio file")
+            self.response = self.hub.post(
+                "respond/audio",
+                endpoint="respond/audio/stream",
+                data=self.iter_chunks(),
+                headers=self.headers,
+                stream=True,
+            )
+        except Exception as e:
+            self.error = e
+
+    def result(self) -> requests.Response:
+        self.thread.join()
+        if self.error:
+            raise self.error
+        return self.response
+
+
+class Interaction:
+    # A captured command on its way through the HUB and out the speaker
+    def __init__(
+        self,
+        command_audio: bytes,
+        stream: AudioStream,
+        wake_word: str,
+        endpoint_time: float,
+        intent: str = None,
+        trace: Trace = None,
+        hub_callback: str = "",
+    ):
+        self.command_audio = command_audio
+        self.stream = stream
+        self.wake_word = wake_word
+        self.endpoint_time = endpoint_time
+        # Set when the local recognizer resolved the command
+        self.intent = intent
+        self.trace = trace or Trace(wake_word)
+        # Sent with the command when it answers a follow up question
+        self.hub_callback = hub_callback
+        # The interaction whose response has to play first
+        self.previous = None
+        # Callback the HUB returned when its response asks a follow up
+        self.follow_up = ""
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
 
-        payload = {
+class Processor:
+    def __init__(self, node):
+        self.node = node
+        self.stream_audio = node.stream_audio
+        self.audio_transport = node.audio_transport
+        self.upload_codec = node.upload_codec
+        self.save_audio_files = node.save_audio_files
+        self.stream_response_audio = node.stream_response_audio
+        self.barge_in_policy = node.barge_in
+
+        self.stream = None
+        self.lock = threading.Lock()
+        self.in_flight = []
+        # The played interaction whose follow up the listener has not
+        # started yet
+        self.pending_follow_up = None
+        self.cancelled = 0
+        self.responses = 0
+        self.streamed_responses = 0
+        self.first_audio_ms = collections.deque(maxlen=100)
+
+    def metadata(self, time_sent: float, wake_word: str, hub_callback: str) -> dict:
+        return {
             "node_id": self.node.id,
             "node_name": self.node.name,
             "node_area": self.node.area,
-            "command_audio_data": command_audio_data.hex(),
-            "hub_callback": self.hub_callback,
+            "hub_callback": hub_callback,
             "last_time_engaged": self.node.last_time_engaged,
+            "wake_word": wake_word,
             "time_sent": time_sent,
         }
 
-        self.hub_callback = ""
+    def start_stream(self) -> AudioStream:
+        if not self.stream_audio:
+            return None
+        time_sent = time.time()
+        content_type = f"audio/L16; rate={self.node.sample_rate}; channels={self.node.audio_channels}"
+        self.stream = AudioStream(
+            self.node.hub,
+            audio_request_headers(
+                content_type,
+                self.metadata(
+                    time_sent,
+                    self.node.listener.wake_word,
+                    self.node.listener.hub_callback,
+                ),
+            ),
+            time_sent,
+        )
+        self.stream.start()
+        if self.node.listener.trace:
+            self.node.listener.trace.mark("upload_start")
+        return self.stream
+
+    def abort_stream(self):
+        if self.stream:
+            self.stream.abort()
+            self.stream = None
 
+    def finish_stream(self, stream: AudioStream) -> requests.Response:
         try:
-            respond_response = requests.post(
-                f"{self.node.hub_api_url}/respond/audio", json=payload
-            )
+            response = stream.result()
         except Exception as e:
-            logger.error(f"Lost connection to HUB | {repr(e)}")
+            logger.warning(f"Streaming upload failed | {repr(e)}")
+            return None
+        if response.status_code in UNSUPPORTED_STATUS_CODES:
+            logger.warning("HUB does not accept streamed audio")
+            self.stream_audio = False
+            return None
+        return response
+
+    def post_audio(
+        self, interaction: Interaction, time_sent: float
+    ) -> requests.Response:
+        metadata = self.metadata(
+            time_sent, interaction.wake_word, interaction.hub_callback
+        )
+        audio = np.frombuffer(interaction.command_audio, dtype=np.int16).reshape(
+            -1, self.node.audio_channels
+        )
+        if self.audio_transport != "hex":
+            data, content_type = encode_audio(
+                audio, self.node.sample_rate, self.upload_codec
+            )
+            interaction.trace.mark("encoded")
+            interaction.trace.mark("upload_start")
+            response = self.node.hub.post(
+                "respond/audio",
+                data=data,
+                headers=audio_request_headers(content_type, metadata),
+                stream=True,
+            )
+            if (
+                self.audio_transport == "binary"
+                or response.status_code not in UNSUPPORTED_STATUS_CODES
+            ):
+                return response
+            response.close()
+            logger.warning("HUB does not accept binary audio, falling back to hex")
+            self.audio_transport = "hex"
+
+        wav_data, _ = encode_audio(audio, self.node.sample_rate, "wav")
+        payload = metadata
+        payload["command_audio_data"] = wav_data.hex()
+        interaction.trace.mark("encoded")
+        interaction.trace.mark("upload_start")
+        return self.node.hub.post(
+            "respond/audio", json=payload, headers={"Accept": ACCEPT_AUDIO}
+        )
+
+    def interaction(self, command_audio: bytes) -> Interaction:
+        # Takes over the streamed upload, the listener may start the next one
+        # while this command is still being processed
+        stream, self.stream = self.stream, None
+        # An interrupt from here on is meant for this command's response, one
+        # from before it was for a response already cancelled
+        self.node.audio_player.interrupted.clear()
+        return Interaction(
+            command_audio,
+            stream,
+            self.node.listener.wake_word,
+            self.node.listener.endpoint_time or time.monotonic(),
+            self.node.listener.intent,
+            self.node.listener.trace,
+            self.node.listener.hub_callback,
+        )
+
+    def track(self, interaction: Interaction):
+        with self.lock:
+            # Only the queue policy plays responses in turn, otherwise the
+            # commands in flight were cancelled by barge_in and are not waited
+            # on
+            if self.barge_in_policy == "queue":
+                previous = [i for i in self.in_flight if not i.cancelled.is_set()]
+                if previous:
+                    interaction.previous = previous[-1]
+            self.in_flight.append(interaction)
+
+    def submit(self, interaction: Interaction):
+        self.track(interaction)
+        threading.Thread(target=self.complete, args=(interaction,), daemon=True).start()
+
+    def run(self, interaction: Interaction):
+        self.track(interaction)
+        self.complete(interaction)
+
+    def complete(self, interaction: Interaction):
+        try:
+            self.process_audio(interaction)
+        finally:
+            interaction.done.set()
+            interaction.trace.set(cancelled=interaction.cancelled.is_set())
+            self.node.traces.append(interaction.trace)
+            with self.lock:
+                self.in_flight.remove(interaction)
+                idle = not self.in_flight
+            # Once the response has played the listener picks up the follow
+            # up without a wake word
+            if interaction.follow_up and not interaction.cancelled.is_set():
+                with self.lock:
+                    self.pending_follow_up = interaction
+                    self.node.engaged = True
+            if self.node.led_controller and idle and not self.node.listener.capturing:
+                self.node.led_controller.off()
+
+    def take_follow_up(self) -> str:
+        # Called by the listener as it starts a capture, which uses up any
+        # pending follow up. Returns the callback to send with the command.
+        with self.lock:
+            interaction, self.pending_follow_up = self.pending_follow_up, None
+            self.node.engaged = False
+        return interaction.follow_up if interaction else ""
+
+    def queueing(self) -> bool:
+        with self.lock:
+            return self.barge_in_policy == "queue" and bool(self.in_flight)
+
+    def barge_in(self):
+        # Called when the listener wakes up. Commands still in flight are
+        # either dropped, or with the queue policy left to answer in turn.
+        with self.lock:
+            in_flight = list(self.in_flight)
+        if in_flight and self.barge_in_policy == "queue":
             return
+        for interaction in in_flight:
+            if not interaction.cancelled.is_set():
+                interaction.cancelled.set()
+                self.cancelled += 1
+        self.node.audio_player.interrupt()
+
+    def process_audio(self, interaction: Interaction):
+        if interaction.intent:
+            self.node.listener.intents.handle(interaction.intent)
+            interaction.trace.mark("intent_handled")
+            logger.info(
+                f"Handled locally in {time.monotonic() - interaction.endpoint_time:.3f}s"
+            )
+            return
+
+        logger.info("Sending audio data to HUB for processing")
+
+        if self.node.led_controller:
+            self.node.led_controller.think()
+
+        endpoint_time = interaction.endpoint_time
+
+        respond_response = None
+        if interaction.stream:
+            time_sent = interaction.stream.time_sent
+            respond_response = self.finish_stream(interaction.stream)
+
+        if respond_response is None:
+            time_sent = time.time()
+            try:
+                respond_response = self.post_audio(interaction, time_sent)
+            except Exception as e:
+                logger.error(f"Lost connection to HUB | {repr(e)}")
+                return
+
+        trace = interaction.trace
+        trace.mark("response_headers")
 
         try:
             respond_response.raise_for_status()
 
-            context = respond_response.json()
+            streamed = self.stream_response_audio and is_audio(
+                respond_response.headers.get("Content-Type", "")
+            )
+            if streamed:
+                context = read_audio_context(respond_response)
+            else:
+                context, response_audio_data = read_audio_response(respond_response)
             response = context["response"]
+            trace.mark("decoded")
+            trace.set(
+                hub_ms={
+                    stage: round(context[f"time_to_{stage}"] * 1000, 2)
+                    for stage in [
+                        "transcribe",
+                        "understand",
+                        "action",
+                        "synthesize",
+                        "run_pipeline",
+                    ]
+                }
+            )
 
             logger.info(f"Command: {context['command']}")
             logger.info(f"Cleaned Command: {context['cleaned_command']}")
@@ -77,27 +378,86 @@ class Processor:
             logger.info(f"- Total: {time.time() - context['time_sent']}")
 
             if response:
+                if interaction.previous and not interaction.previous.cancelled.is_set():
+                    interaction.previous.done.wait()
+                if interaction.cancelled.is_set():
+                    logger.info("Dropping response, a newer command interrupted it")
+                    return
+
                 if self.node.led_controller:
                     self.node.led_controller.speak()
 
-                self.last_time_engaged = time_sent
+                self.node.last_time_engaged = time_sent
 
-                self.hub_callback = context["hub_callback"]
+                # Stops any earcon, interrupt() would also stop this response
+                self.node.audio_player.stop_sounds()
+                # ETag is the HUB's content hash for the audio, otherwise the
+                # response text stands in for it
+                cache_key = respond_response.headers.get("ETag") or response
+                cached = None
+                if streamed:
+                    # The headers are in before the body, skip the download
+                    # when the audio is already cached
+                    cached = self.node.response_cache.get(cache_key)
+                if cached:
+                    source = "cached"
+                    respond_response.close()
+                    response_audio_data = cached
+                    first_audio = time.monotonic()
+                    self.node.audio_player.play_audio_data(response_audio_data)
+                elif streamed:
+                    source = "streamed"
+                    response_audio_data = self.node.audio_player.play_audio_stream(
+                        respond_response.iter_content(chunk_size=RESPONSE_CHUNK_BYTES)
+                    )
+                    first_audio = self.node.audio_player.first_audio
+                    self.streamed_responses += 1
+                    if not self.node.audio_player.interrupted.is_set():
+                        self.node.response_cache.put(cache_key, response_audio_data)
+                else:
+                    source = "buffered"
+                    self.node.response_cache.put(cache_key, response_audio_data)
+                    first_audio = time.monotonic()
+                    self.node.audio_player.play_audio_data(response_audio_data)
+                trace.mark("playback_done")
+                trace.set(source=source)
+                if source == "streamed" and self.node.audio_player.first_audio_dac:
+                    trace.mark(
+                        "first_audio_dac", self.node.audio_player.first_audio_dac
+                    )
+                self.responses += 1
+                if first_audio:
+                    trace.mark("first_audio", first_audio)
+                    self.first_audio_ms.append((first_audio - endpoint_time) * 1000)
+                    logger.info(
+                        f"Time to First Audio: {first_audio - endpoint_time:.3f}s"
+                        f" ({source})"
+                    )
 
-                if self.hub_callback:
-                    self.node.engaged = True
+                if self.save_audio_files:
+                    with open(os.path.join(FILESDIR, "response.wav"), "wb") as wav_file:
+                        wav_file.write(response_audio_data)
 
-                response_audio_data = context["response_audio_data"]
-                data = bytes.fromhex(response_audio_data)
-                response_file_path = os.path.join(FILESDIR, "response.wav")
-                with open(response_file_path, "wb") as wav_file:
-                    wav_file.write(data)
-
-                self.node.audio_player.interrupt()
-                self.node.audio_player.play_audio_file(response_file_path)
+                interaction.follow_up = context["hub_callback"]
 
             else:
                 logger.error("No response from HUB")
 
         except Exception:
             logger.exception("Exception while processing audio")
+        finally:
+            respond_response.close()
+
+    def stats(self) -> dict:
+        stats = {
+            "stream_response_audio": self.stream_response_audio,
+            "responses": self.responses,
+            "streamed_responses": self.streamed_responses,
+            "in_flight": len(self.in_flight),
+            "cancelled": self.cancelled,
+            "underruns": self.node.audio_player.underruns,
+        }
+        first_audio_ms = list(self.first_audio_ms)
+        if first_audio_ms:
+            stats["time_to_first_audio_ms"] = latency_stats(first_audio_ms)
+        return stats
@@ -0,0 +1,126 @@
+import collections
+import hashlib
+import logging
+import os
+import threading
+import typing
+
+logger = logging.getLogger("response_cache")
+
+from node.dir import CACHEDIR
+
+
+class ResponseCache:
+    # Synthesized response audio keyed by the text it says, or by a content
+    # hash when the HUB sends one. An in memory LRU bounded by size, backed
+    # by an optional on disk LRU that survives restarts. Files on disk are
+    # named by the sha256 of the key and their mtime is the recency.
+    def __init__(
+        self,
+        max_bytes: int,
+        disk_max_bytes: int = 0,
+        directory: str = CACHEDIR,
+    ):
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.directory = directory
+        if disk_max_bytes > 0:
+            os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(
+            self.directory, f"{hashlib.sha256(key.encode()).hexdigest()}.wav"
+        )
+
+    def get(self, key: str) -> typing.Optional[bytes]:
+        with self.lock:
+            audio_data = self.entries.get(key)
+            if audio_data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return audio_data
+
+        if self.disk_max_bytes > 0:
+            path = self.path(key)
+            try:
+                with open(path, "rb") as wav_file:
+                    audio_data = wav_file.read()
+                os.utime(path)
+            except OSError:
+                pass
+            else:
+                with self.lock:
+                    self.disk_hits += 1
+                self.remember(key, audio_data)
+                return audio_data
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, audio_data: bytes):
+        if not audio_data:
+            return
+        self.remember(key, audio_data)
+        if self.disk_max_bytes > 0 and len(audio_data) <= self.disk_max_bytes:
+            try:
+                path = self.path(key)
+                with open(f"{path}.part", "wb") as wav_file:
+                    wav_file.write(audio_data)
+                os.replace(f"{path}.part", path)
+                self.trim_disk()
+            except OSError as e:
+                logger.warning(f"Failed to cache response on disk | {repr(e)}")
+
+    def remember(self, key: str, audio_data: bytes):
+        if len(audio_data) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = audio_data
+            self.size += len(audio_data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def disk_files(self) -> typing.List[os.DirEntry]:
+        return [
+            entry for entry in os.scandir(self.directory) if entry.name.endswith(".wav")
+        ]
+
+    def trim_disk(self):
+        files = sorted(self.disk_files(), key=lambda entry: entry.stat().st_mtime)
+        size = sum(entry.stat().st_size for entry in files)
+        for entry in files:
+            if size <= self.disk_max_bytes:
+                break
+            size -= entry.stat().st_size
+            os.remove(entry.path)
+
+    def stats(self) -> typing.Dict:
+        with self.lock:
+            stats = {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+        if self.disk_max_bytes > 0:
+            files = self.disk_files()
+            stats["disk_entries"] = len(files)
+            stats["disk_bytes"] = sum(entry.stat().st_size for entry in files)
+            stats["disk_max_bytes"] = self.disk_max_bytes
+        return stats
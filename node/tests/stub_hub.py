@@ -0,0 +1,127 @@
+import json
+import os
+import time
+
+import click
+import flask
+
+# Minimal stand-in for the HUB api so the node can be exercised without a
+# real HUB. Run it and start the node with --hub_ip 127.0.0.1
+#
+#   python node/tests/stub_hub.py
+#   python -m node --hub_ip 127.0.0.1
+
+SOUNDSDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../sounds")
+
+app = flask.Flask("StubHub")
+
+
+def response_audio() -> bytes:
+    return open(os.path.join(SOUNDSDIR, "activate.wav"), "rb").read()
+
+
+def stream(audio_data: bytes):
+    # Send the WAV in pieces the way an incremental synthesizer would, with
+    # --stream_delay_ms between them
+    delay = app.config["STREAM_DELAY_MS"] / 1000
+    for start in range(0, len(audio_data), 4096):
+        if start:
+            time.sleep(delay)
+        yield audio_data[start : start + 4096]
+
+
+def reply(context: dict, audio_data: bytes) -> flask.Response:
+    # Answer with a binary body when the node asks for one, hex JSON otherwise
+    if "audio/wav" in flask.request.headers.get("Accept", ""):
+        return flask.Response(
+            stream(audio_data),
+            mimetype="audio/wav",
+            headers={"X-OVA-Context": json.dumps(context)},
+        )
+    context["response_audio_data"] = audio_data.hex()
+    return flask.jsonify(context)
+
+
+def respond(
+    audio_bytes: int, time_sent: float, hub_callback: str = ""
+) -> flask.Response:
+    time_received = time.time()
+    response = f"Received {audio_bytes} bytes of audio"
+    context = {
+        "command": response,
+        "cleaned_command": response,
+        "encoded_command": response,
+        "skill": "stub",
+        "action": "stub",
+        "conf": 1.0,
+        "response": response,
+        "hub_callback": hub_callback,
+        "time_sent": time_sent,
+        "time_received": time_received,
+        "time_to_transcribe": 0.0,
+        "time_to_understand": 0.0,
+        "time_to_action": 0.0,
+        "time_to_synthesize": 0.0,
+        "time_to_run_pipeline": 0.0,
+        "time_returned": time.time(),
+    }
+    return reply(context, response_audio())
+
+
+@app.route("/api", methods=["GET"])
+def api():
+    return {"is_ova": True}, 200
+
+
+@app.route("/api/node/<node_id>/sync_up", methods=["PUT"])
+@app.route("/api/node/<node_id>/sync_down", methods=["PUT"])
+def sync(node_id: str):
+    return flask.request.json, 200
+
+
+@app.route("/api/respond/audio", methods=["POST"])
+def respond_audio():
+    content_type = flask.request.headers.get("Content-Type", "")
+    if content_type.startswith("audio/L16"):
+        # Streamed upload, read the body as it arrives
+        metadata = json.loads(flask.request.headers["X-OVA-Metadata"])
+        audio_bytes = 0
+        first_chunk = None
+        while True:
+            chunk = flask.request.stream.read(4096)
+            if not chunk:
+                break
+            if first_chunk is None:
+                first_chunk = time.time()
+            audio_bytes += len(chunk)
+        if first_chunk:
+            print(
+                f"Streamed {audio_bytes} bytes, first audio {first_chunk - metadata['time_sent']:.3f}s "
+                f"after stream start, body finished {time.time() - first_chunk:.3f}s later"
+            )
+        return respond(audio_bytes, metadata["time_sent"])
+    if content_type.startswith("audio/"):
+        # Buffered upload as wav, flac or ogg
+        metadata = json.loads(flask.request.headers["X-OVA-Metadata"])
+        return respond(len(flask.request.get_data()), metadata["time_sent"])
+
+    payload = flask.request.json
+    audio_bytes = len(payload["command_audio_data"]) // 2
+    return respond(audio_bytes, payload["time_sent"])
+
+
+@app.route("/api/synthesizer/synthesize/text/<text>", methods=["GET"])
+def synthesize(text: str):
+    return reply({}, response_audio())
+
+
+@click.command()
+@click.option("--port", required=False, default=7123, type=int)
+@click.option("--stream_delay_ms", required=False, default=0, type=int)
+def main(port, stream_delay_ms):
+    app.config["STREAM_DELAY_MS"] = stream_delay_ms
+    app.run(host="0.0.0.0", port=port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import itertools
+import time
+import typing
+
+ids = itertools.count(1)
+
+
+def stream_to_monotonic(stream_time: float, current_time: float) -> float:
+    # PortAudio reports ADC and DAC times on the stream's own clock, shift
+    # them onto time.monotonic using the callback's current time
+    return time.monotonic() + stream_time - current_time
+
+
+class Trace:
+    # Monotonic timestamps for the stages of one interaction, from the wake
+    # word leaving the ADC to the response reaching the DAC. Stages marked
+    # with a PortAudio time are when the audio was at the converter, the
+    # rest are when the node got there.
+    def __init__(self, wake_word: typing.Optional[str] = None):
+        self.id = next(ids)
+        self.time = time.time()
+        self.wake_word = wake_word
+        self.stages = {}
+        self.info = {}
+
+    def mark(self, stage: str, at: typing.Optional[float] = None):
+        self.stages[stage] = time.monotonic() if at is None else at
+
+    def set(self, **info):
+        self.info.update(info)
+
+    def to_dict(self) -> typing.Dict:
+        # Offsets from the first stage, in the order the stages happened
+        stages = sorted(self.stages.items(), key=lambda stage: stage[1])
+        origin = stages[0][1] if stages else 0
+        return {
+            "id": self.id,
+            "time": self.time,
+            "wake_word": self.wake_word,
+            **self.info,
+            "stages_ms": {
+                stage: round((at - origin) * 1000, 2) for stage, at in stages
+            },
+        }
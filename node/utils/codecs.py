@@ -0,0 +1,35 @@
+import io
+import logging
+import typing
+
+import numpy as np
+import soundfile as sf
+
+logger = logging.getLogger("codecs")
+
+# codec: (soundfile format, soundfile subtype, content type)
+CODECS = {
+    "wav": ("WAV", "PCM_16", "audio/wav"),
+    "flac": ("FLAC", "PCM_16", "audio/flac"),
+    "vorbis": ("OGG", "VORBIS", "audio/ogg; codecs=vorbis"),
+    "opus": ("OGG", "OPUS", "audio/ogg; codecs=opus"),
+}
+
+
+def encode_audio(
+    audio: np.ndarray, sample_rate: int, codec: str
+) -> typing.Tuple[bytes, str]:
+    if codec not in CODECS:
+        raise RuntimeError(f"Unsupported codec: {codec}")
+    format, subtype, content_type = CODECS[codec]
+    encoded = io.BytesIO()
+    try:
+        sf.write(encoded, audio, sample_rate, format=format, subtype=subtype)
+    except Exception as e:
+        # Opus only takes a handful of sample rates, fall back to plain WAV
+        # rather than dropping the command
+        if codec == "wav":
+            raise
+        logger.warning(f"Failed to encode audio as {codec} | {repr(e)}")
+        return encode_audio(audio, sample_rate, "wav")
+    return encoded.getvalue(), content_type
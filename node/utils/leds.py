@@ -20,7 +20,7 @@ class Pixels:
     def wakeup(self):
         pass
 
-    def listen(self):
+    def listen(self, direction=None):
         pass
 
     def think(self):
@@ -55,22 +55,33 @@ class Respeaker4MicHat(Pixels):
         time.sleep(0.1)
         self.brightness = 0
         self.stop = False
+        self.pattern = np.ones(self.n_pixels)
+
+    def point(self, direction):
+        # Light the pixel facing the talker and dim the rest of the ring
+        if direction is None:
+            self.pattern = np.ones(self.n_pixels)
+            return
+        self.pattern = np.full(self.n_pixels, 0.05)
+        center = int(round(direction / 360 * self.n_pixels)) % self.n_pixels
+        self.pattern[center] = 1
+        self.pattern[(center - 1) % self.n_pixels] = 0.3
+        self.pattern[(center + 1) % self.n_pixels] = 0.3
 
     def fade(self, direction=1, speed=0.05):
         # brightness = 0 if direction == 1 else 1
         while not self.stop:
-            self.pixels = (
-                np.array([self.color for _ in range(self.n_pixels)]) * self.brightness
-            )
+            self.pixels = self.pattern[:, None] * self.color * self.brightness
             self.show()
             time.sleep(0.05)
             self.brightness += speed * direction
             if self.brightness <= 0 or self.brightness > 1:
                 break
 
-    def listen(self):
+    def listen(self, direction=None):
         self.interrupt()
         self.stop = False
+        self.point(direction)
 
         def run():
             self.brightness = 0
@@ -112,6 +123,7 @@ class Respeaker4MicHat(Pixels):
     def speak(self):
         self.interrupt()
         self.stop = False
+        self.point(None)
 
         def run():
             while not self.stop:
@@ -0,0 +1,60 @@
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+
+class Resampler:
+    # Streaming polyphase resampler for int16 mono audio. The filter history
+    # and output phase carry over between blocks, so resampling block by block
+    # gives the same samples as resampling the whole signal at once. Only the
+    # output samples are computed, never the zero stuffed intermediate signal.
+    def __init__(self, in_rate: int, out_rate: int, zero_crossings: int = 8):
+        gcd = math.gcd(in_rate, out_rate)
+        self.up = out_rate // gcd
+        self.down = in_rate // gcd
+        self.passthrough = self.up == self.down
+        if self.passthrough:
+            return
+
+        factor = max(self.up, self.down)
+        taps = self.up * math.ceil((2 * zero_crossings * factor + 1) / self.up)
+        h = signal.firwin(taps, 0.9 / factor, window=("kaiser", 8.0)) * self.up
+        self.taps_per_phase = taps // self.up
+        # phases[p, j] = h[p + j * up], reversed so it lines up with a window
+        # of input that ends on the newest sample
+        self.phases = np.ascontiguousarray(
+            h.reshape(self.taps_per_phase, self.up).T[:, ::-1], dtype=np.float32
+        )
+        self.reset()
+
+    def reset(self):
+        if self.passthrough:
+            return
+        self.history = np.zeros(self.taps_per_phase - 1, dtype=np.float32)
+        # Position of the next output in the upsampled domain, relative to
+        # the start of the next block
+        self.position = 0
+
+    def process(self, chunk: bytes) -> bytes:
+        if self.passthrough:
+            return chunk
+
+        x = np.frombuffer(chunk, dtype=np.int16)
+        samples = np.concatenate((self.history, x))
+        # windows[i] holds the filter's view of the input ending at x[i]
+        windows = sliding_window_view(samples, self.taps_per_phase)
+        upsampled = len(x) * self.up
+        t = np.arange(self.position, upsampled, self.down)
+        if self.up == 1:
+            y = windows[self.position :: self.down] @ self.phases[0]
+        else:
+            y = np.einsum("ij,ij->i", windows[t // self.up], self.phases[t % self.up])
+
+        if len(t):
+            self.position = int(t[-1]) + self.down - upsampled
+        else:
+            self.position -= upsampled
+        self.history = samples[len(samples) - len(self.history) :].copy()
+        return np.clip(np.round(y), -32768, 32767).astype(np.int16).tobytes()
@@ -0,0 +1,78 @@
+import typing
+
+
+class RingBuffer:
+    # Preallocated byte ring. The capacity is rounded up to a whole number of
+    # frames and the read position only ever moves in whole frames, so a frame
+    # never straddles the end of the buffer and can be handed out as a
+    # memoryview without copying.
+    def __init__(self, capacity: int, frame_size: int = 1):
+        if frame_size < 1:
+            raise ValueError("Frame size must be at least 1 byte")
+        self.frame_size = frame_size
+        self.capacity = max(1, -(-capacity // frame_size)) * frame_size
+        self._buffer = bytearray(self.capacity)
+        self._view = memoryview(self._buffer)
+        # Reads are frame aligned, so one view per frame slot is all frames()
+        # ever hands out
+        self._frames = [
+            self._view[start : start + frame_size]
+            for start in range(0, self.capacity, frame_size)
+        ]
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
+
+    def write(self, data: typing.Union[bytes, bytearray, memoryview]) -> int:
+        # Returns the number of bytes of old data overwritten to make room
+        data = memoryview(data).cast("B")
+        n = len(data)
+        if n >= self.capacity:
+            dropped = self._size + n - self.capacity
+            self._view[:] = data[n - self.capacity :]
+            self._start = 0
+            self._size = self.capacity
+            return dropped
+
+        dropped = 0
+        overflow = self._size + n - self.capacity
+        if overflow > 0:
+            # Drop whole frames so the read position stays frame aligned
+            dropped = min(self._size, -(-overflow // self.frame_size) * self.frame_size)
+            self._start = (self._start + dropped) % self.capacity
+            self._size -= dropped
+            if self._size == 0:
+                self._start = 0
+
+        end = (self._start + self._size) % self.capacity
+        first = min(n, self.capacity - end)
+        self._view[end : end + first] = data[:first]
+        if first < n:
+            self._view[: n - first] = data[first:]
+        self._size += n
+        return dropped
+
+    def frames(self) -> typing.Iterator[memoryview]:
+        # Consumes and yields every complete frame. Each view is only valid
+        # until the next write.
+        while self._size >= self.frame_size:
+            frame = self._frames[self._start // self.frame_size]
+            self._start = (self._start + self.frame_size) % self.capacity
+            self._size -= self.frame_size
+            yield frame
+
+    def segments(self) -> typing.Tuple[memoryview, ...]:
+        # Views over the buffered data in order, without consuming it
+        end = self._start + self._size
+        if end <= self.capacity:
+            return (self._view[self._start : end],)
+        return (
+            self._view[self._start :],
+            self._view[: end - self.capacity],
+        )
@@ -0,0 +1,15 @@
+import typing
+
+import numpy as np
+
+
+def latency_stats(values: typing.Sequence[float]) -> typing.Dict[str, float]:
+    # The latest value and the percentiles of a history of latencies
+    values = list(values)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        "last": round(values[-1], 2),
+        "p50": round(float(p50), 2),
+        "p90": round(float(p90), 2),
+        "p99": round(float(p99), 2),
+    }
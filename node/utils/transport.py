@@ -0,0 +1,72 @@
+import json
+import struct
+import typing
+
+import requests
+
+# Audio travels as the raw request/response body, with the JSON that used to
+# wrap it moved into these headers. HUBs that predate this keep using the
+# hex-in-JSON format.
+METADATA_HEADER = "X-OVA-Metadata"
+CONTEXT_HEADER = "X-OVA-Context"
+ACCEPT_AUDIO = "audio/wav, application/json"
+
+# Responses from a HUB that could not parse a binary body
+UNSUPPORTED_STATUS_CODES = [404, 405, 415, 422, 501]
+
+
+def is_audio(content_type: str) -> bool:
+    return content_type.split(";")[0].strip().startswith("audio/")
+
+
+def audio_request_headers(content_type: str, metadata: dict) -> typing.Dict:
+    return {
+        "Content-Type": content_type,
+        "Accept": ACCEPT_AUDIO,
+        METADATA_HEADER: json.dumps(metadata),
+    }
+
+
+def read_audio_context(response: requests.Response) -> typing.Dict:
+    return json.loads(response.headers.get(CONTEXT_HEADER, "{}"))
+
+
+def read_audio_response(
+    response: requests.Response,
+) -> typing.Tuple[typing.Dict, bytes]:
+    if is_audio(response.headers.get("Content-Type", "")):
+        return read_audio_context(response), response.content
+    context = response.json()
+    audio_data = context.pop("response_audio_data", None) or ""
+    return context, bytes.fromhex(audio_data)
+
+
+def parse_wav_header(
+    data: bytes,
+) -> typing.Optional[typing.Tuple[int, int, int, int, int]]:
+    # Returns (format, sample_rate, channels, sample_width, data_offset) once
+    # everything up to the data chunk has arrived. Streamed WAVs carry a
+    # placeholder length, so the data chunk size is ignored.
+    if len(data) < 12:
+        return None
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("Not a WAV stream")
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack("<4sI", data[offset : offset + 8])
+        offset += 8
+        if chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data before fmt chunk")
+            return (*fmt, offset)
+        if offset + size > len(data):
+            return None
+        if chunk_id == b"fmt ":
+            audio_format, channels, sample_rate = struct.unpack(
+                "<HHI", data[offset : offset + 8]
+            )
+            bits = struct.unpack("<H", data[offset + 14 : offset + 16])[0]
+            fmt = (audio_format, sample_rate, channels, bits // 8)
+        offset += size + (size & 1)
+    return None
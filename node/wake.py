@@ -1,49 +1,344 @@
+import collections
+import contextlib
+import importlib.util
 import logging
 import os
+import time
+import typing
 
 import numpy as np
-import openwakeword
 
 logger = logging.getLogger("wake")
 
 from openwakeword.model import Model
+from openwakeword.vad import VAD
 
 from node.dir import WAKEWORDMODELSDIR
+from node.inference import SessionFactory
+from node.model_store import ModelStore
+from node.utils.ring_buffer import RingBuffer
+
+# openWakeWord scores 80ms frames and each score looks back over about two
+# seconds of audio (76 mel frames per embedding, 16 embeddings per score)
+BLOCK_SAMPLES = 1280
+CONTEXT_BLOCKS = 26
 
 
 class OpenWakeWord:
     def __init__(
         self,
-        wake_word: str,
-        wake_word_conf_threshold: float,
+        wake_words: typing.Dict[str, float],
         speex_noise_suppression: bool,
         vad_threshold: float,
         inference_framework: str = "onnx",
+        gate_rms: float = 0,
+        gate_hangover_ms: int = 800,
+        model_store: ModelStore = None,
+        sessions: SessionFactory = None,
+        smoothing_blocks: int = 1,
+        patience: int = 1,
+        patience_window: int = 1,
+        refractory_ms: int = 0,
+        verifier: bool = False,
+        verifier_threshold: float = 0.1,
     ):
-        self.wake_word = wake_word
+        # wake word: confidence threshold
+        self.wake_words = wake_words
         inference_framework = inference_framework
-        self.confidence_threshold = wake_word_conf_threshold
-
-        model_file = os.path.join(WAKEWORDMODELSDIR, f"{wake_word}.onnx")
-        if not os.path.exists(model_file):
-            raise RuntimeError("Wake word model file does not exist")
-
-        openwakeword.utils.download_models()
-        self.owwModel = Model(
-            wakeword_models=[model_file],
-            enable_speex_noise_suppression=speex_noise_suppression,
-            vad_threshold=vad_threshold,
-            inference_framework=inference_framework,
+
+        start = time.perf_counter()
+        store = model_store or ModelStore()
+        self.inference_framework = inference_framework
+        model_files = []
+        for wake_word in wake_words:
+            model_file = os.path.join(
+                WAKEWORDMODELSDIR, f"{wake_word}.{inference_framework}"
+            )
+            if not os.path.exists(model_file):
+                raise RuntimeError(f"Wake word model file does not exist: {wake_word}")
+            store.verify_wake_word(model_file)
+            model_files.append(model_file)
+
+        # Optional openWakeWord custom verifiers, trained per speaker and
+        # stored next to the wake word model
+        verifiers = {}
+        if verifier:
+            for wake_word in wake_words:
+                verifier_file = os.path.join(
+                    WAKEWORDMODELSDIR, f"{wake_word}_verifier.pkl"
+                )
+                if not os.path.exists(verifier_file):
+                    logger.warning(f"No custom verifier for {wake_word}")
+                    continue
+                store.verify_wake_word(verifier_file)
+                verifiers[wake_word] = verifier_file
+        feature_models = store.feature_models(inference_framework)
+
+        self.sessions = None
+        tuned = contextlib.nullcontext()
+        if inference_framework == "onnx":
+            self.sessions = sessions or SessionFactory()
+            tuned = self.sessions.patch()
+
+        with tuned:
+            # Every wake word model scores the same melspectrogram and
+            # embedding features, each extra word only adds its own small
+            # classifier
+            self.owwModel = Model(
+                wakeword_models=model_files,
+                enable_speex_noise_suppression=speex_noise_suppression,
+                vad_threshold=0,
+                inference_framework=inference_framework,
+                custom_verifier_models=verifiers,
+                custom_verifier_threshold=verifier_threshold,
+                melspec_model_path=feature_models["melspectrogram"],
+                embedding_model_path=feature_models["embedding"],
+            )
+            # Model would load the VAD from the openWakeWord package directory
+            if vad_threshold > 0:
+                self.owwModel.vad_threshold = vad_threshold
+                self.owwModel.vad = VAD(model_path=feature_models["vad"])
+        self.load_time = time.perf_counter() - start
+        # Labels predict() keeps a score history under
+        self.labels = [
+            label
+            for mdl in self.owwModel.models
+            for label in (
+                [mdl]
+                if self.owwModel.model_outputs[mdl] == 1
+                else self.owwModel.class_mapping[mdl].values()
+            )
+        ]
+        logger.info(
+            f"Wake word models loaded in {self.load_time * 1000:.1f}ms "
+            f"({store.downloads} downloaded)"
+        )
+
+        # Energy gate in front of the model. Quiet blocks skip inference but
+        # are kept, and replayed through the feature extractor when the gate
+        # opens, so the streaming features match an ungated run.
+        self.gate_rms = gate_rms
+        self.gate_hangover_blocks = int(round(gate_hangover_ms / 80))
+        self.gate_hangover = 0
+        self.pending_blocks = 0
+        self.skipped = RingBuffer(
+            CONTEXT_BLOCKS * BLOCK_SAMPLES * 2, frame_size=BLOCK_SAMPLES * 2
         )
 
+        # Debouncing. A word fires once the moving average of its score over
+        # smoothing_blocks is above its threshold on patience of the last
+        # patience_window blocks, and nothing fires for refractory_ms of audio
+        # after an activation. The debouncing is counted in blocks so replays
+        # behave like live audio, the refractory period runs on the capture
+        # time of the blocks so it also covers audio the wake word never saw.
+        self.scores = {
+            wake_word: collections.deque(maxlen=max(1, smoothing_blocks))
+            for wake_word in wake_words
+        }
+        self.patience = patience
+        self.hits = {
+            wake_word: collections.deque(maxlen=max(patience, patience_window))
+            for wake_word in wake_words
+        }
+        self.refractory_s = refractory_ms / 1000
+        self.refractory_until = None
+        self.verifiers = list(verifiers)
+
+        self.blocks = 0
+        self.skipped_blocks = 0
+        self.replayed_blocks = 0
+        self.inference_blocks = 0
+        self.inference_time = 0
+        self.replay_time = 0
+        self.detections = {wake_word: 0 for wake_word in wake_words}
+        self.last_wake_word = None
+
     def reset(self):
+        # The refractory period is in audio time, the part of it left after
+        # the command was captured carries over into the next listen session
         self.owwModel.reset()
+        self.skipped.clear()
+        self.pending_blocks = 0
+        self.gate_hangover = 0
+        self.clear_scores()
+
+    def clear_scores(self):
+        for wake_word in self.wake_words:
+            self.scores[wake_word].clear()
+            self.hits[wake_word].clear()
+
+    def gate(self, audio: np.ndarray) -> bool:
+        rms = np.sqrt(np.mean(np.square(audio, dtype=np.float32)))
+        if rms >= self.gate_rms:
+            self.gate_hangover = self.gate_hangover_blocks
+            return True
+        if self.gate_hangover:
+            self.gate_hangover -= 1
+            return True
+        return False
+
+    def replay(self):
+        if not self.pending_blocks:
+            return
+        skipped = [np.frombuffer(s, dtype=np.int16) for s in self.skipped.segments()]
+        audio = np.concatenate(skipped)
+        start = time.process_time()
+        self.owwModel.preprocessor(audio)
+        # predict() zeroes a word until it has 5 scores of history and reads
+        # the VAD a few blocks back, so every skipped block gets a zero score
+        # and the VAD hears the skipped audio the ring still holds
+        for label in self.labels:
+            self.owwModel.prediction_buffer[label].extend([0.0] * self.pending_blocks)
+        if self.owwModel.vad_threshold > 0:
+            kept = len(self.skipped) // (BLOCK_SAMPLES * 2)
+            self.owwModel.vad.prediction_buffer.extend(
+                [0.0] * (self.pending_blocks - kept)
+            )
+            for block in range(kept):
+                self.owwModel.vad(
+                    audio[block * BLOCK_SAMPLES : (block + 1) * BLOCK_SAMPLES]
+                )
+        self.replay_time += time.process_time() - start
+        self.replayed_blocks += self.pending_blocks
+        self.pending_blocks = 0
+        self.skipped.clear()
 
-    def listen_for_wake_word(self, chunk: bytes) -> bool:
+    def stats(self) -> typing.Dict:
+        inference = self.inference_time / max(1, self.inference_blocks)
+        return {
+            "wake_words": self.wake_words,
+            "detections": self.detections,
+            "last_wake_word": self.last_wake_word,
+            "load_ms": self.load_time * 1000,
+            "inference_framework": self.inference_framework,
+            "session_profile": self.sessions.profile if self.sessions else None,
+            "optimized_model_cache_hits": (
+                self.sessions.cache_hits if self.sessions else None
+            ),
+            "verifiers": self.verifiers,
+            "refractory_ms": self.refractory_s * 1000,
+            "gate_rms": self.gate_rms,
+            "blocks": self.blocks,
+            "skipped": self.skipped_blocks,
+            "skipped_fraction": self.skipped_blocks / max(1, self.blocks),
+            "replayed": self.replayed_blocks,
+            "cpu_seconds": self.inference_time + self.replay_time,
+            "cpu_seconds_saved": self.skipped_blocks * inference - self.replay_time,
+        }
+
+    def decide(
+        self, prediction: typing.Dict[str, float], at: float
+    ) -> typing.Optional[str]:
+        fired = []
+        for wake_word, threshold in self.wake_words.items():
+            scores = self.scores[wake_word]
+            scores.append(prediction.get(wake_word, 0.0))
+            score = sum(scores) / len(scores)
+            self.hits[wake_word].append(score > threshold)
+            if sum(self.hits[wake_word]) >= self.patience:
+                fired.append((score - threshold, wake_word))
+
+        if self.refractory_until is not None and at < self.refractory_until:
+            return None
+        if not fired:
+            return None
+        # Report the word furthest over its threshold if several fire at once
+        _, wake_word = max(fired)
+        self.refractory_until = at + self.refractory_s
+        self.clear_scores()
+        self.detections[wake_word] += 1
+        self.last_wake_word = wake_word
+        return wake_word
+
+    def listen_for_wake_word(
+        self, chunk: bytes, captured_at: typing.Optional[float] = None
+    ) -> typing.Optional[str]:
+        # captured_at is the monotonic time the block was captured, without
+        # it the audio fed so far stands in for the time
         audio = np.frombuffer(chunk, dtype=np.int16)
+        self.blocks += 1
+        if captured_at is None:
+            captured_at = self.blocks * BLOCK_SAMPLES / 16000
+        if self.gate_rms:
+            if not self.gate(audio):
+                self.skipped_blocks += 1
+                self.pending_blocks += 1
+                self.skipped.write(chunk)
+                # Quiet blocks score zero
+                return self.decide({}, captured_at)
+            self.replay()
+
         # Feed to openWakeWord model
+        start = time.process_time()
         prediction = self.owwModel.predict(audio)
+        self.inference_time += time.process_time() - start
+        self.inference_blocks += 1
         logger.debug(prediction)
-        if prediction[self.wake_word] > self.confidence_threshold:
-            return True
-        return False
+        return self.decide(prediction, captured_at)
+
+
+def available_backends(wake_words: typing.Dict[str, float]) -> typing.List[str]:
+    backends = ["onnx"]
+    if importlib.util.find_spec("tflite_runtime") is None:
+        return backends
+    # The shipped wake word models are ONNX, tflite needs a copy of each
+    if all(
+        os.path.exists(os.path.join(WAKEWORDMODELSDIR, f"{wake_word}.tflite"))
+        for wake_word in wake_words
+    ):
+        backends.append("tflite")
+    return backends
+
+
+def calibrate(
+    wake_words: typing.Dict[str, float],
+    onnx_profile: str = "single",
+    blocks: int = 60,
+    warmup_blocks: int = 10,
+) -> typing.Dict:
+    # Runs the same short workload through every backend available on this
+    # node and picks the one with the lowest median latency per block
+    audio = np.random.default_rng(0).standard_normal(blocks * BLOCK_SAMPLES) * 1000
+    audio = audio.astype(np.int16)
+
+    latency_ms = {}
+    failures = {}
+    for backend in available_backends(wake_words):
+        try:
+            wake = OpenWakeWord(
+                wake_words=wake_words,
+                speex_noise_suppression=False,
+                vad_threshold=0,
+                inference_framework=backend,
+                sessions=SessionFactory(onnx_profile),
+            )
+        except Exception as e:
+            logger.warning(f"Failed to load {backend} backend | {repr(e)}")
+            failures[backend] = repr(e)
+            continue
+
+        times = []
+        for i in range(blocks):
+            chunk = audio[i * BLOCK_SAMPLES : (i + 1) * BLOCK_SAMPLES].tobytes()
+            start = time.perf_counter()
+            wake.listen_for_wake_word(chunk)
+            if i >= warmup_blocks:
+                times.append((time.perf_counter() - start) * 1000)
+        latency_ms[backend] = {
+            "p50": float(np.percentile(times, 50)),
+            "p90": float(np.percentile(times, 90)),
+            "load": wake.load_time * 1000,
+        }
+        logger.info(f"{backend}: {latency_ms[backend]['p50']:.2f}ms per block")
+
+    if not latency_ms:
+        raise RuntimeError(
+            "No wake word backend could be loaded | "
+            + ", ".join(f"{backend}: {e}" for backend, e in failures.items())
+        )
+    return {
+        "backend": min(latency_ms, key=lambda backend: latency_ms[backend]["p50"]),
+        "wake_words": sorted(wake_words),
+        "onnx_profile": onnx_profile,
+        "latency_ms": latency_ms,
+    }
@@ -3,15 +3,16 @@ import os
 import threading
 
 import flask
-import requests
 
 logger = logging.getLogger("werkzeug")
 
 from node import Node, config
 from node.dir import FILESDIR, LOGFILE, WAKEWORDMODELSDIR
+from node.model_store import ModelStore
 from node.schemas import NodeConfig
 from node.updater import Updater
 from node.utils.hardware import list_microphones, list_speakers
+from node.utils.transport import ACCEPT_AUDIO, is_audio, read_audio_response
 
 
 def create_app(node: Node, updater: Updater):
@@ -95,14 +96,12 @@ def create_app(node: Node, updater: Updater):
     @app.route("/api/play/audio", methods=["POST"])
     def play_audio():
         try:
-            data = flask.request.json
-            audio_data = data["audio_data"]
-            data = bytes.fromhex(audio_data)
-            audio_file_path = os.path.join(FILESDIR, "play.wav")
-            with open(audio_file_path, "wb") as wav_file:
-                wav_file.write(data)
+            if is_audio(flask.request.content_type or ""):
+                data = flask.request.get_data()
+            else:
+                data = bytes.fromhex(flask.request.json["audio_data"])
             node.audio_player.interrupt()
-            node.audio_player.play_audio_file(audio_file_path, asynchronous=True)
+            node.audio_player.play_audio_data(data, asynchronous=True)
         except Exception:
             logger.exception("Exception in POST /api/play/audio")
             return {}, 400
@@ -130,17 +129,17 @@ def create_app(node: Node, updater: Updater):
     @app.route("/api/announce/<text>", methods=["POST"])
     def announce(text: str):
         try:
-            respond_response = requests.get(
-                f"{node.hub_api_url}/synthesizer/synthesize/text/{text}"
-            )
-            context = respond_response.json()
-            response_audio_data = context["response_audio_data"]
-            data = bytes.fromhex(response_audio_data)
-            audio_file_path = os.path.join(FILESDIR, "play.wav")
-            with open(audio_file_path, "wb") as wav_file:
-                wav_file.write(data)
+            data = node.response_cache.get(text)
+            if data is None:
+                respond_response = node.hub.get(
+                    f"synthesizer/synthesize/text/{text}",
+                    endpoint="synthesizer/synthesize/text",
+                    headers={"Accept": ACCEPT_AUDIO},
+                )
+                _, data = read_audio_response(respond_response)
+                node.response_cache.put(text, data)
             node.audio_player.interrupt()
-            node.audio_player.play_audio_file(audio_file_path, asynchronous=True)
+            node.audio_player.play_audio_data(data, asynchronous=True)
         except Exception:
             logger.exception("Exception in POST /api/announce/<text>")
             return {}, 400
@@ -186,6 +185,83 @@ def create_app(node: Node, updater: Updater):
             return {}, 400
         return {}, 200
 
+    @app.route("/api/stats/capture", methods=["GET"])
+    def capture_stats():
+        try:
+            return node.microphone.stats(), 200
+        except AttributeError:
+            logger.exception("Exception in GET /api/stats/capture")
+            return {}, 400
+
+    @app.route("/api/stats/wake", methods=["GET"])
+    def wake_stats():
+        try:
+            return node.listener.wake.stats(), 200
+        except AttributeError:
+            logger.exception("Exception in GET /api/stats/wake")
+            return {}, 400
+
+    @app.route("/api/traces", methods=["GET"])
+    def traces():
+        try:
+            limit = flask.request.args.get("limit", default=None, type=int)
+            # Workers append while this runs, copy before iterating
+            recent = list(node.traces)[::-1][:limit]
+            return {"traces": [trace.to_dict() for trace in recent]}, 200
+        except Exception:
+            logger.exception("Exception in GET /api/traces")
+            return {}, 400
+
+    @app.route("/api/stats/listener", methods=["GET"])
+    def listener_stats():
+        try:
+            return node.listener.stats(), 200
+        except Exception:
+            logger.exception("Exception in GET /api/stats/listener")
+            return {}, 400
+
+    @app.route("/api/stats/intents", methods=["GET"])
+    def intent_stats():
+        try:
+            if not node.listener.intents:
+                return {"enabled": False}, 200
+            return {"enabled": True, **node.listener.intents.stats()}, 200
+        except Exception:
+            logger.exception("Exception in GET /api/stats/intents")
+            return {}, 400
+
+    @app.route("/api/stats/response", methods=["GET"])
+    def response_stats():
+        try:
+            return node.processor.stats(), 200
+        except Exception:
+            logger.exception("Exception in GET /api/stats/response")
+            return {}, 400
+
+    @app.route("/api/stats/response_cache", methods=["GET"])
+    def response_cache_stats():
+        try:
+            return node.response_cache.stats(), 200
+        except Exception:
+            logger.exception("Exception in GET /api/stats/response_cache")
+            return {}, 400
+
+    @app.route("/api/stats/hub", methods=["GET"])
+    def hub_stats():
+        try:
+            return node.hub.stats(), 200
+        except Exception:
+            logger.exception("Exception in GET /api/stats/hub")
+            return {}, 400
+
+    @app.route("/api/stats/inference", methods=["GET"])
+    def inference_stats():
+        try:
+            return config.get("wake_calibration"), 200
+        except AttributeError:
+            logger.exception("Exception in GET /api/stats/inference")
+            return {}, 400
+
     @app.route("/api/hardware/microphones", methods=["GET"])
     def get_microphones():
         try:
@@ -225,10 +301,11 @@ def create_app(node: Node, updater: Updater):
             if file.filename == "":
                 raise Exception("No file selected")
 
-            if file and file.filename.rsplit(".")[-1].lower() in ["onnx"]:
+            if file and file.filename.rsplit(".")[-1].lower() in ["onnx", "tflite"]:
                 filename = os.path.join(WAKEWORDMODELSDIR, file.filename)
                 with open(filename, "wb") as file_to_save:
                     file_to_save.write(file.read())
+                ModelStore().register(filename)
             else:
                 raise Exception("Invalid file type")
         except Exception: